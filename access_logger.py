@@ -1,5 +1,6 @@
+import threading
 import time
-from collections import deque
+from collections import OrderedDict, deque
 from dataclasses import dataclass
 from typing import List
 import json
@@ -18,6 +19,8 @@ class AccessLogger:
     def __init__(self, path: str = "access_log.json"):
         self.path = path
         self.events: List[dict] = []
+        # concurrent queries log from several threads
+        self._lock = threading.Lock()
 
         if os.path.exists(self.path):
             try:
@@ -26,12 +29,15 @@ class AccessLogger:
             except Exception:
                 self.events = []
 
-    def log(self, row_groups: List[int]):
+    def log(self, row_groups: List[int], session: str | None = None):
         ts = time.time()
-        for rg in row_groups:
-            event = {"ts": ts, "block": int(rg)}
-            self.events.append(event)
-        self._flush()
+        with self._lock:
+            for rg in row_groups:
+                event = {"ts": ts, "block": int(rg)}
+                if session is not None:
+                    event["session"] = session
+                self.events.append(event)
+            self._flush()
 
     def _flush(self):
         with open(self.path, "w") as f:
@@ -45,17 +51,77 @@ class AccessLogger:
 
 
 class GlobalHistory:
-    # Maintains a rolling history of block ids.
-    def __init__(self, maxlen: int = 200):
+    # Maintains a rolling history of block ids, over all sessions and per
+    # session. Concurrent clients interleave in the global history, each
+    # session's own sequence keeps its pattern. At most max_sessions
+    # sessions are kept, the least recently active is dropped first.
+    def __init__(self, maxlen: int = 200, max_sessions: int = 1024):
+        self.maxlen = maxlen
         self.history = deque(maxlen=maxlen)
+        self.max_sessions = max_sessions
+        # session -> {"history": deque, "version": int, "last_access": ts}
+        self.sessions = OrderedDict()
+        # version counts recorded accesses, waiters are woken on every change
+        self.version = 0
+        self._cond = threading.Condition()
 
-    def record(self, block_id: int):
-        self.history.append(int(block_id))
+    def record(self, block_id: int, session: str = "GLOBAL"):
+        with self._cond:
+            self.history.append(int(block_id))
+            self.version += 1
 
-    def get_sequence(self, length: int | None = None) -> List[int]:
-        if length is None or length >= len(self.history):
-            return list(self.history)
-        return list(self.history)[-length:]
+            state = self.sessions.get(session)
+            if state is None:
+                state = {"history": deque(maxlen=self.maxlen), "version": 0, "last_access": 0.0}
+                self.sessions[session] = state
+                if len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            self.sessions.move_to_end(session)
+            state["history"].append(int(block_id))
+            state["version"] += 1
+            state["last_access"] = time.time()
+
+            self._cond.notify_all()
+
+    def session_versions(self, active_within: float | None = None) -> dict:
+        """
+        session -> number of accesses recorded for it, for the sessions
+        active in the last active_within seconds (all if None).
+        """
+        now = time.time()
+        with self._cond:
+            return {
+                session: state["version"]
+                for session, state in self.sessions.items()
+                if active_within is None or now - state["last_access"] <= active_within
+            }
+
+    def end_session(self, session: str):
+        with self._cond:
+            self.sessions.pop(session, None)
+
+    def wait_for_access(self, version: int, timeout: float | None = None) -> int:
+        """
+        Block until an access newer than version is recorded, or timeout.
+        Returns the current version, equal to version on timeout.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def get_sequence(self, length: int | None = None, session: str | None = None) -> List[int]:
+        # the interleaved history of all sessions when session is None
+        with self._cond:
+            if session is None:
+                seq = list(self.history)
+            else:
+                state = self.sessions.get(session)
+                seq = list(state["history"]) if state is not None else []
+        if length is None or length >= len(seq):
+            return seq
+        return seq[-length:]
 
     def clear(self):
-        self.history.clear()
+        with self._cond:
+            self.history.clear()
+            self.sessions.clear()
@@ -0,0 +1,113 @@
+# async_engine.py
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+
+from query_enginev5 import StorageEngineV5
+
+
+class AsyncStorageEngine:
+    """
+    asyncio front end for StorageEngineV5.
+
+    Every query runs on a worker thread of its own executor, where the
+    engine gives it a cursor of its CursorPool, so Parquet reads and
+    DuckDB execution of concurrent queries overlap instead of blocking
+    the event loop.
+
+    Admission: at most max_concurrency queries run at a time (by default
+    the engine's pool size), later ones wait in arrival order. With
+    max_waiting set, a query arriving while that many are already waiting
+    is rejected right away with a RuntimeError, which keeps the queueing
+    delay bounded.
+    """
+
+    def __init__(
+        self,
+        engine: StorageEngineV5,
+        max_concurrency: Optional[int] = None,
+        max_waiting: Optional[int] = None,
+    ):
+        self.engine = engine
+        if max_concurrency is None:
+            max_concurrency = engine.cursors.size
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_waiting = max_waiting
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="engine-query"
+        )
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._running = 0
+        self._waiting = 0
+
+    async def _run(self, run, sql: str, *args):
+        if (
+            self.max_waiting is not None
+            and self._slots.locked()
+            and self._waiting >= self.max_waiting
+        ):
+            raise RuntimeError(
+                f"query rejected, {self._waiting} queries already waiting for admission"
+            )
+
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        loop = asyncio.get_running_loop()
+        self._running += 1
+        future = self.executor.submit(run, sql, *args)
+        # the slot is freed once the worker is done, also when the awaiting
+        # task was cancelled while the query still runs
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._done))
+        return await asyncio.wrap_future(future)
+
+    def _done(self):
+        self._running -= 1
+        self._slots.release()
+
+    async def query(
+        self,
+        sql: str,
+        approx: bool = False,
+        sample_fraction: float = 0.1,
+        confidence: float = 0.95,
+        seed: Optional[int] = None,
+        session: str = "GLOBAL",
+    ) -> pd.DataFrame:
+        """
+        Run sql without blocking the event loop and return a DataFrame.
+        Arguments are those of StorageEngineV5.query.
+        """
+        return await self._run(self.engine.query, sql, approx, sample_fraction, confidence, seed, session)
+
+    async def query_arrow(
+        self,
+        sql: str,
+        approx: bool = False,
+        sample_fraction: float = 0.1,
+        confidence: float = 0.95,
+        seed: Optional[int] = None,
+        session: str = "GLOBAL",
+    ) -> pa.Table:
+        """
+        Like query, but returns an Arrow Table.
+        """
+        return await self._run(self.engine.query_arrow, sql, approx, sample_fraction, confidence, seed, session)
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "waiting": self._waiting,
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,96 @@
+# benchmark_prefetch_model.py
+#
+# Compares the fp32 LSTMPrefetcher with its int8 TorchScript export
+# (written by retrain_model.py) and with a variant that quantizes the
+# LSTM too: latency of one prediction as the scheduler runs it, on a
+# whole sequence and as one stateful step, and top-k hit rates on the
+# training dataset.
+#
+#   python benchmark_prefetch_model.py [trained_model.pt] [training_dataset.json]
+
+import json
+import os
+import sys
+import time
+
+import torch
+from tabulate import tabulate
+from torch.utils.data import DataLoader, TensorDataset
+
+from evaluate_model import topk_hit_rate
+from model import LSTMPrefetcher, compiled_model_path, export_compiled_model, quantize_for_inference
+
+
+def latency_ms(fn, inputs, repeat=3):
+    """
+    Mean and p99 milliseconds of fn over inputs, best of repeat runs.
+    """
+    best = None
+    for _ in range(repeat):
+        times = []
+        for args in inputs:
+            start = time.perf_counter()
+            fn(*args)
+            times.append((time.perf_counter() - start) * 1000)
+        times.sort()
+        run = (sum(times) / len(times), times[int(0.99 * (len(times) - 1))])
+        if best is None or run[0] < best[0]:
+            best = run
+    return best
+
+
+def measure(name, model, X, loader, samples=200):
+    window = X.size(1)
+    lengths = torch.tensor([window], dtype=torch.long)
+    singles = [(X[i:i + 1], lengths) for i in range(min(samples, X.size(0)))]
+    tokens = [(X[i, -1:], None) for i in range(min(samples, X.size(0)))]
+
+    with torch.no_grad():
+        # warm up, TorchScript optimizes on the first calls
+        for args in singles[:10]:
+            model(*args)
+        full = latency_ms(model, singles)
+        step = latency_ms(lambda t, s: model.predict_from_state(model.step(t, s)[0]), tokens)
+
+    row = [name, f"{full[0]:.3f}", f"{full[1]:.3f}", f"{step[0]:.3f}"]
+    for k in (1, 5, 10):
+        row.append(f"{topk_hit_rate(model, loader, k=k):.4f}")
+    return row
+
+
+if __name__ == "__main__":
+    model_path = sys.argv[1] if len(sys.argv) > 1 else "trained_model.pt"
+    dataset_path = sys.argv[2] if len(sys.argv) > 2 else "training_dataset.json"
+
+    with open(dataset_path, "r") as f:
+        data = json.load(f)
+    X = torch.tensor(data["inputs"], dtype=torch.long)
+    Y = torch.tensor(data["labels"], dtype=torch.long)
+    vocab_size = int(data["vocab_size"])
+
+    Y_multihot = torch.zeros(Y.size(0), vocab_size, dtype=torch.float)
+    Y_multihot[torch.arange(Y.size(0)), Y] = 1.0
+    loader = DataLoader(TensorDataset(X, Y_multihot), batch_size=32, shuffle=False)
+
+    eager = LSTMPrefetcher(num_tokens=vocab_size, embed_dim=16, hidden_dim=64, num_layers=1)
+    eager.load_state_dict(torch.load(model_path, map_location="cpu"))
+    eager.eval()
+
+    compiled_path = compiled_model_path(model_path)
+    if not os.path.exists(compiled_path):
+        export_compiled_model(eager, compiled_path)
+    compiled = torch.jit.load(compiled_path, map_location="cpu")
+
+    print(f"{X.size(0)} samples, window {X.size(1)}, vocab {vocab_size}, {torch.get_num_threads()} threads")
+    rows = [
+        measure("eager fp32", eager, X, loader),
+        measure("int8 TorchScript", compiled, X, loader),
+        measure("int8 + LSTM TorchScript", torch.jit.script(quantize_for_inference(eager, quantize_lstm=True)), X, loader),
+    ]
+    print(tabulate(
+        rows,
+        headers=["model", "predict ms", "p99 ms", "step ms", "top-1", "top-5", "top-10"],
+        tablefmt="github",
+    ))
+    size = os.path.getsize(model_path), os.path.getsize(compiled_path)
+    print(f"file size: {size[0] / 1024:.0f} KB fp32, {size[1] / 1024:.0f} KB int8")
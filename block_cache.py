@@ -1,63 +1,218 @@
-from collections import OrderedDict
+import threading
+import time
+from collections import OrderedDict, deque
 from typing import Any, Optional
 
+import pyarrow as pa
+
+from cache_policy import LRUPolicy, make_policy
+
 
 class BlockCache:
-    #  memory LRU cache for prefetched microblocks.
+    #  memory cache for prefetched microblocks.
     # Mapping:
     #     block_id -> PyArrow Table
-    # On insertion:
-    # If block_id already exists, update position to MRU.
-    # If cache is full, evict LRU block.
+    # self.cache keeps blocks in recency order (MRU last), the policy
+    # decides which block to evict:
+    #     "lru"      evict the least recently used block (default)
+    #     "tinylfu"  W-TinyLFU, frequency based admission, scan resistant
+    #     "cost"     evict the block cheapest to reload per byte and use
+    # With a SpillTier, evicted Arrow tables are written to it and a later
+    # get maps them back from disk instead of missing.
+    #
+    # With prefetch_capacity > 0, prefetched blocks (put with
+    # prefetched=True) live in their own region of that many blocks,
+    # outside the policy, and the policy manages the remaining capacity.
+    # The first real get promotes a block into the demand region. Unused
+    # prefetches are evicted oldest first when their region is full, so
+    # predictions never push out blocks queries are using. Every prefetch
+    # is recorded as used or wasted in prefetch_log.
+    # With prefetch_capacity 0 prefetched blocks are ordinary blocks.
 
-    def __init__(self, capacity: int = 64):
+    def __init__(self, capacity: int = 64, spill=None, policy="lru", prefetch_capacity: int = 0):
         self.capacity = capacity
         self.cache = OrderedDict()
+        self.spill = spill
+        self.prefetch_capacity = min(max(0, prefetch_capacity), capacity - 1)
+        self.policy = make_policy(policy, capacity - self.prefetch_capacity)
+        self.hits = 0
+        self.misses = 0
+
+        # block_id -> prefetch record, oldest first
+        self.prefetched = OrderedDict()
+        # finished prefetch records, used or wasted
+        self.prefetch_log = deque(maxlen=1000)
+        self.prefetch_stats = {"issued": 0, "used": 0, "wasted": 0}
+
+        # queries on several threads and the prefetcher share the cache
+        self._lock = threading.RLock()
 
     def get(self, block_id: int) -> Optional[Any]:
         # Retrieve a block from the cache.
         # Move to MRU (most recently used) position.
         # Returns:PyArrow Table or None if not present.
-        if block_id not in self.cache:
-            return None
+        evicted = []
+        with self._lock:
+            self.policy.record_access(block_id)
+            if block_id in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(block_id, last=True)
+                block_data = self.cache[block_id]
+                if block_id in self.prefetched:
+                    evicted = self._promote(block_id)
+                else:
+                    self.policy.on_hit(block_id)
+            else:
+                self.misses += 1
+                block_data = None
 
-        self.cache.move_to_end(block_id, last=True)
-        return self.cache[block_id]
+        self._spill(evicted)
+        if block_data is not None or self.spill is None:
+            return block_data
 
-    def put(self, block_id: int, block_data: Any):
+        # memory miss, map the block back from the spill tier
+        block_data = self.spill.get(block_id)
+        if block_data is not None:
+            self.put(block_id, block_data)
+        return block_data
+
+    def put(self, block_id: int, block_data: Any, prefetched: bool = False, confidence: Optional[float] = None):
         # If block exists:
         #     update and move to MRU.
+        # Otherwise insert it and evict what the policy picks, which can
+        # be the new block itself when the policy does not admit it.
+        # prefetched blocks go to the prefetch region instead.
+        prefetched = prefetched and self.prefetch_capacity > 0
+        with self._lock:
+            if block_id in self.cache:
+                if prefetched:
+                    # already cached, nothing to do for a prediction
+                    return
+                self.cache.move_to_end(block_id, last=True)
+                self.cache[block_id] = block_data
+                if block_id in self.prefetched:
+                    evicted = self._promote(block_id)
+                else:
+                    self.policy.on_hit(block_id)
+                    evicted = []
+            elif prefetched:
+                self.cache[block_id] = block_data
+                self.prefetched[block_id] = {
+                    "block": block_id,
+                    "confidence": confidence,
+                    "prefetched_at": time.time(),
+                }
+                self.prefetch_stats["issued"] += 1
+                evicted = self._fit()
+            else:
+                # insert MRU
+                self.cache[block_id] = block_data
+                evicted = self._admit(block_id, block_data)
 
-        # If at capacity:
-        #     evict LRU block.
-        # if block already present, replace and move to MRU
-        if block_id in self.cache:
-            self.cache.move_to_end(block_id, last=True)
-            self.cache[block_id] = block_data
-            return
+        # spill outside the lock, writing the file is slow
+        self._spill(evicted)
 
-        if len(self.cache) >= self.capacity:
-            evicted_block_id, _ = self.cache.popitem(last=False)
-            # print("evicted", evicted_block_id)
+    def _admit(self, block_id, block_data):
+        # hand a demand block to the policy, returns the evicted blocks
+        evicted = [
+            (victim, self.cache.pop(victim))
+            for victim in self.policy.on_insert(block_id, block_data)
+        ]
+        # print("evicted", [v for v, _ in evicted])
+        return evicted
 
-        # insert MRU
-        self.cache[block_id] = block_data
+    def _promote(self, block_id):
+        # first real hit on a prefetched block
+        record = self.prefetched.pop(block_id)
+        record["used"] = True
+        record["used_after"] = time.time() - record["prefetched_at"]
+        self.prefetch_log.append(record)
+        self.prefetch_stats["used"] += 1
+        return self._admit(block_id, self.cache[block_id])
+
+    def _fit(self):
+        # unused prefetches go first, when their region is full
+        while self.prefetched and len(self.prefetched) > self.prefetch_capacity:
+            block_id, record = self.prefetched.popitem(last=False)
+            self.cache.pop(block_id, None)
+            record["used"] = False
+            self.prefetch_log.append(record)
+            self.prefetch_stats["wasted"] += 1
+        # never used, not worth spilling
+        return []
+
+    def _spill(self, evicted):
+        if self.spill is not None:
+            for victim, data in evicted:
+                if isinstance(data, pa.Table):
+                    self.spill.put(victim, data)
 
     def contains(self, block_id: int) -> bool:
-        return block_id in self.cache
+        if block_id in self.cache:
+            return True
+        return self.spill is not None and self.spill.contains(block_id)
+
+    def touch(self, block_id: int):
+        # move a cached block to MRU without counting a hit or telling the
+        # policy of an access, e.g. blocks restored by WarmCache. Only
+        # LRU orders its evictions by recency, it moves the block too.
+        with self._lock:
+            if block_id not in self.cache:
+                return
+            self.cache.move_to_end(block_id, last=True)
+            if isinstance(self.policy, LRUPolicy) and block_id in self.policy.order:
+                self.policy.order.move_to_end(block_id)
 
     def remove(self, block_id: int):
-        self.cache.pop(block_id, None)
+        with self._lock:
+            self.cache.pop(block_id, None)
+            if self.prefetched.pop(block_id, None) is None:
+                self.policy.on_remove(block_id)
+        if self.spill is not None:
+            self.spill.remove(block_id)
 
     def clear(self):
-        self.cache.clear()
+        with self._lock:
+            self.cache.clear()
+            self.prefetched.clear()
+            self.policy.clear()
+        if self.spill is not None:
+            self.spill.clear()
 
     def __len__(self):
         return len(self.cache)
 
+    def prefetch_usefulness(self):
+        # share of finished prefetches that a query used before eviction
+        with self._lock:
+            finished = self.prefetch_stats["used"] + self.prefetch_stats["wasted"]
+            return self.prefetch_stats["used"] / finished if finished else None
+
+    def prefetch_outcomes(self, n: Optional[int] = None):
+        # (confidence, used) of the last n finished prefetches
+        with self._lock:
+            records = list(self.prefetch_log)
+        if n is not None:
+            records = records[-n:]
+        return [(r["confidence"], r["used"]) for r in records]
+
     def stats(self):
-        return {
-            "capacity": self.capacity,
-            "size": len(self.cache),
-            "cached_blocks": list(self.cache.keys()),
-        }
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "capacity": self.capacity,
+                "size": len(self.cache),
+                "policy": self.policy.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "prefetch_capacity": self.prefetch_capacity,
+                "prefetched_unused": len(self.prefetched),
+                "prefetch": dict(self.prefetch_stats),
+                "cached_blocks": list(self.cache.keys()),
+                "prefetched_blocks": list(self.prefetched.keys()),
+            }
+        stats["prefetch_usefulness"] = self.prefetch_usefulness()
+        if self.spill is not None:
+            stats["spill"] = self.spill.stats()
+        return stats
@@ -0,0 +1,98 @@
+# block_pipeline.py
+
+import queue
+import threading
+from typing import Callable, List
+
+import pyarrow as pa
+
+
+_END = object()
+
+
+class BlockPipeline:
+    """
+    Loads microblocks on a background thread into a bounded queue and
+    exposes them as an Arrow RecordBatchReader.
+
+    DuckDB can scan the reader while later blocks are still being read,
+    so Parquet I/O and query execution overlap. At most `depth` loaded
+    blocks wait in the queue, which bounds memory.
+
+    The reader can be scanned once. Call close() after the query so the
+    loader thread stops, also when DuckDB stopped early (e.g. LIMIT).
+    """
+
+    def __init__(
+        self,
+        row_groups: List[int],
+        load_block: Callable[[int], pa.Table],
+        schema: pa.Schema,
+        depth: int = 4,
+    ):
+        self.row_groups = list(row_groups)
+        self.load_block = load_block
+        self.schema = schema
+
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._stop = threading.Event()
+        # DuckDB may pull from several threads, batches are handed out one at a time
+        self._lock = threading.Lock()
+        self._pending = []
+
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        # wait for room, give up once the pipeline is closed
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for rg in self.row_groups:
+                if self._stop.is_set():
+                    return
+                table = self.load_block(rg)
+                if not table.schema.equals(self.schema):
+                    table = table.cast(self.schema)
+                if not self._put(table):
+                    return
+            self._put(_END)
+        except Exception as e:
+            print(f"[BlockPipeline] load error: {e}")
+            self._put(e)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> pa.RecordBatch:
+        with self._lock:
+            while not self._pending:
+                try:
+                    item = self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    if self._stop.is_set():
+                        raise StopIteration
+                    continue
+
+                if item is _END:
+                    # leave the marker for any other consumer thread
+                    self._queue.put(_END)
+                    raise StopIteration
+                if isinstance(item, Exception):
+                    raise item
+                self._pending = item.to_batches()
+            return self._pending.pop(0)
+
+    def reader(self) -> pa.RecordBatchReader:
+        return pa.RecordBatchReader.from_batches(self.schema, self)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=2.0)
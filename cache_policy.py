@@ -0,0 +1,294 @@
+# cache_policy.py
+
+from collections import OrderedDict
+from typing import Any, List
+
+
+class CountMinSketch:
+    """
+    Approximate access frequencies with 4 bit counters.
+
+    After sample_size increments every counter is halved, so old
+    popularity fades and the sketch follows the current workload.
+    """
+
+    def __init__(self, width: int, depth: int = 4, sample_size: int | None = None):
+        self.width = 1
+        while self.width < max(16, width):
+            self.width *= 2
+        self.depth = depth
+        self.table = [[0] * self.width for _ in range(depth)]
+        self.sample_size = sample_size or 10 * self.width
+        self.additions = 0
+
+    def _slots(self, key: Any):
+        h = hash(key)
+        for i in range(self.depth):
+            # one hash, a different odd multiplier per row
+            yield i, ((h * (2 * i + 0x9E3779B1)) >> 7) & (self.width - 1)
+
+    def add(self, key: Any):
+        for i, j in self._slots(key):
+            if self.table[i][j] < 15:
+                self.table[i][j] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self._age()
+
+    def estimate(self, key: Any) -> int:
+        return min(self.table[i][j] for i, j in self._slots(key))
+
+    def _age(self):
+        for row in self.table:
+            for j in range(self.width):
+                row[j] >>= 1
+        self.additions //= 2
+
+    def clear(self):
+        for row in self.table:
+            for j in range(self.width):
+                row[j] = 0
+        self.additions = 0
+
+
+class LRUPolicy:
+    """
+    Evict the least recently used block.
+    """
+
+    name = "lru"
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.order = OrderedDict()
+
+    def record_access(self, key):
+        pass
+
+    def on_hit(self, key):
+        self.order.move_to_end(key)
+
+    def on_insert(self, key, value=None) -> List[Any]:
+        """
+        Track a newly cached key, returns the keys to evict (which may be
+        key itself when it is not admitted).
+        """
+        self.order[key] = None
+        victims = []
+        while len(self.order) > self.capacity:
+            victim, _ = self.order.popitem(last=False)
+            victims.append(victim)
+        return victims
+
+    def on_remove(self, key):
+        self.order.pop(key, None)
+
+    def clear(self):
+        self.order.clear()
+
+
+class TinyLFUPolicy:
+    """
+    W-TinyLFU: a small LRU window in front of a segmented LRU main area
+    (probation and protected).
+
+    New blocks enter the window. A block leaving the window only enters
+    the main area if the count-min sketch says it is accessed more often
+    than the probation victim it would replace. One large scan touches
+    each block once, so its blocks lose against the frequently used ones
+    and pass through the window without evicting the working set.
+    """
+
+    name = "tinylfu"
+
+    def __init__(self, capacity: int, window_fraction: float = 0.01, protected_fraction: float = 0.8):
+        self.capacity = capacity
+        self.window_size = max(1, int(round(capacity * window_fraction)))
+        self.main_size = max(0, capacity - self.window_size)
+        self.protected_size = int(self.main_size * protected_fraction)
+
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        # wide enough that keys of a scan rarely collide with the hot ones
+        self.sketch = CountMinSketch(max(256, 8 * capacity))
+
+    def record_access(self, key):
+        # every lookup counts, hit or miss, prefetches do not
+        self.sketch.add(key)
+
+    def on_hit(self, key):
+        if key in self.window:
+            self.window.move_to_end(key)
+        elif key in self.protected:
+            self.protected.move_to_end(key)
+        elif key in self.probation:
+            # second hit in the main area, promote
+            del self.probation[key]
+            self.protected[key] = None
+            if len(self.protected) > self.protected_size:
+                demoted, _ = self.protected.popitem(last=False)
+                self.probation[demoted] = None
+
+    def on_insert(self, key, value=None) -> List[Any]:
+        self.window[key] = None
+        if len(self.window) <= self.window_size:
+            return []
+
+        candidate, _ = self.window.popitem(last=False)
+        if len(self.probation) + len(self.protected) < self.main_size:
+            self.probation[candidate] = None
+            return []
+        if self.main_size == 0:
+            return [candidate]
+
+        main = self.probation if self.probation else self.protected
+        victim = next(iter(main))
+        if self.sketch.estimate(candidate) > self.sketch.estimate(victim):
+            del main[victim]
+            self.probation[candidate] = None
+            return [victim]
+        return [candidate]
+
+    def on_remove(self, key):
+        for segment in (self.window, self.probation, self.protected):
+            segment.pop(key, None)
+
+    def clear(self):
+        self.window.clear()
+        self.probation.clear()
+        self.protected.clear()
+        self.sketch.clear()
+
+
+# relative cpu cost of decompressing one byte, per parquet codec
+CODEC_COST = {
+    "UNCOMPRESSED": 0.0,
+    "SNAPPY": 0.5,
+    "LZ4": 0.4,
+    "LZ4_RAW": 0.4,
+    "LZO": 0.5,
+    "ZSTD": 1.0,
+    "GZIP": 2.0,
+    "BROTLI": 2.5,
+}
+
+
+class CostAwarePolicy:
+    """
+    Evict the block that is cheapest to lose, GreedyDual-Size-Frequency
+    style. Each block has the priority
+
+        clock + usage * frequency_weight * reload_cost / decoded_bytes
+
+    usage is access_count * ewma_usage of the row group in MicroBlockIndex,
+    ewma alone saturates after a few accesses and would not tell a hot
+    block from one a scan touched twice.
+    reload_cost is the compressed byte_length of its column chunks,
+    weighted by CODEC_COST of their compression, plus decode_cost per
+    decoded byte. decoded_bytes is the size of the cached table. The
+    block with the lowest priority is evicted and clock moves up to it,
+    so blocks not touched for a while age out.
+
+    StorageEngineV5 binds its index on construction. Keys without index
+    entries (e.g. partial aggregates) fall back to counting their own
+    cache hits and a reload cost equal to their size.
+    """
+
+    name = "cost"
+
+    def __init__(
+        self,
+        capacity: int,
+        index=None,
+        table_name: str | None = None,
+        decode_cost: float = 0.25,
+        frequency_weight: float = 1.0,
+    ):
+        self.capacity = capacity
+        self.index = index
+        self.table_name = table_name
+        self.decode_cost = decode_cost
+        self.frequency_weight = frequency_weight
+
+        self.clock = 0.0
+        # key -> [clock at last touch, reload cost, decoded bytes, own hits]
+        self.entries = {}
+
+    def bind(self, index, table_name: str):
+        self.index = index
+        self.table_name = table_name
+
+    def _index_blocks(self, key):
+        if self.index is None:
+            return []
+        if isinstance(key, int):
+            key = (self.table_name, key)
+        elif not (isinstance(key, tuple) and len(key) == 2 and isinstance(key[0], str)):
+            return []
+        return list(self.index.by_row_group.get(key, {}).values())
+
+    def _reload_cost(self, key, decoded_bytes: int) -> float:
+        blocks = self._index_blocks(key)
+        if not blocks:
+            return float(decoded_bytes)
+        read = sum(
+            b.byte_length * (1.0 + CODEC_COST.get(str(b.compression_info).upper(), 1.0))
+            for b in blocks
+        )
+        return read + self.decode_cost * decoded_bytes
+
+    def _usage(self, key, entry) -> float:
+        blocks = self._index_blocks(key)
+        if blocks:
+            return blocks[0].access_count * blocks[0].ewma_usage
+        return entry[3]
+
+    def priority(self, key) -> float:
+        entry = self.entries[key]
+        touched, cost, size, _ = entry
+        return touched + self._usage(key, entry) * self.frequency_weight * cost / max(1, size)
+
+    def record_access(self, key):
+        pass
+
+    def on_hit(self, key):
+        entry = self.entries[key]
+        entry[0] = self.clock
+        entry[3] += 1.0
+
+    def on_insert(self, key, value=None) -> List[Any]:
+        size = getattr(value, "nbytes", 0) or 1
+        self.entries[key] = [self.clock, self._reload_cost(key, size), size, 0.0]
+        if len(self.entries) <= self.capacity:
+            return []
+
+        victim = min(self.entries, key=self.priority)
+        self.clock = self.priority(victim)
+        del self.entries[victim]
+        return [victim]
+
+    def on_remove(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+        self.clock = 0.0
+
+
+POLICIES = {
+    "lru": LRUPolicy,
+    "tinylfu": TinyLFUPolicy,
+    "cost": CostAwarePolicy,
+}
+
+
+def make_policy(policy, capacity: int):
+    """
+    Policy instance from a name in POLICIES or an already built policy.
+    """
+    if isinstance(policy, str):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown cache policy {policy}, use one of {sorted(POLICIES)}")
+        return POLICIES[policy](capacity)
+    return policy
@@ -0,0 +1,82 @@
+# cursor_pool.py
+
+import itertools
+import queue
+from contextlib import contextmanager
+from typing import Optional
+
+import duckdb
+
+
+class PooledCursor:
+    """
+    A DuckDB cursor with the suffix its registrations are named with.
+
+    Registered Arrow tables are local to a cursor, and the suffix keeps
+    their names unique as well, so a query only ever sees its own blocks.
+    """
+
+    def __init__(self, con: duckdb.DuckDBPyConnection, slot: str):
+        self.con = con
+        self.slot = slot
+        self.closed = False
+
+    def close(self):
+        # a no-op the second time, an error path may release it again
+        if not self.closed:
+            self.closed = True
+            self.con.close()
+
+    def view_name(self, base: str) -> str:
+        return f"{base}_{self.slot}"
+
+
+class CursorPool:
+    """
+    Fixed set of cursors on one DuckDB connection.
+
+    Cursors share the catalog of the connection (the Parquet views made by
+    register_table) but not their registrations. acquire blocks while all
+    cursors are in use. open gives an extra cursor outside the pool for
+    results that outlive the call, e.g. streamed readers.
+    """
+
+    def __init__(self, con: duckdb.DuckDBPyConnection, size: int = 4):
+        self.con = con
+        self.size = max(1, size)
+
+        self._free = queue.Queue()
+        for i in range(self.size):
+            self._free.put(PooledCursor(con.cursor(), f"c{i}"))
+        self._extra_ids = itertools.count()
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledCursor:
+        return self._free.get(timeout=timeout)
+
+    def release(self, cursor: PooledCursor):
+        self._free.put(cursor)
+
+    @contextmanager
+    def cursor(self):
+        cursor = self.acquire()
+        try:
+            yield cursor
+        finally:
+            self.release(cursor)
+
+    def open(self) -> PooledCursor:
+        # caller closes it with cursor.close()
+        return PooledCursor(self.con.cursor(), f"x{next(self._extra_ids)}")
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "free": self._free.qsize(),
+        }
+
+    def close(self):
+        while True:
+            try:
+                self._free.get_nowait().con.close()
+            except queue.Empty:
+                break
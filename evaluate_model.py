@@ -1,7 +1,19 @@
+import contextlib
+import io
 import json
-import torch
-from torch.utils.data import TensorDataset, DataLoader
-from model import LSTMPrefetcher
+import os
+import time
+from tabulate import tabulate
+from predictors import PREDICTORS, make_predictor
+from prefetch_scheduler import PrefetchScheduler
+
+try:
+    import torch
+    from torch.utils.data import TensorDataset, DataLoader
+    from model import LSTMPrefetcher
+except ImportError:
+    # without torch only the predictors in predictors.py are evaluated
+    torch = None
 
 def topk_hit_rate(model, loader, k=10, device="cpu"):
     """
@@ -61,11 +73,76 @@ def mean_reciprocal_rank(model, loader, device="cpu"):
     
     return sum(reciprocal_ranks) / len(reciprocal_ranks) if reciprocal_ranks else 0.0
 
-def main():
-    # Load dataset
-    with open("training_dataset.json", "r") as f:
-        data = json.load(f)
-    
+def access_trace(data):
+    """
+    Block id sequence the sliding windows of the dataset were cut from.
+    """
+    inputs, labels = data["inputs"], data["labels"]
+    for i in range(1, len(inputs)):
+        if inputs[i][-1] != labels[i - 1]:
+            raise ValueError("dataset is not a sliding window over one access trace")
+    idx2id = {int(k): int(v) for k, v in data["idx2id"].items()}
+    return [idx2id[t] for t in list(inputs[0]) + list(labels)]
+
+def evaluate_predictor(predictor, trace, window, ks=(1, 3, 5, 10)):
+    """
+    Replays trace through predictor online. Every block is predicted from
+    the window blocks before it, the same samples the LSTM is scored on,
+    and observed afterwards, so learning predictors only know the past.
+    Returns the top-k hit rates and microseconds per prediction.
+    """
+    hits = {k: 0 for k in ks}
+    elapsed = 0.0
+    for block_id in trace[:window]:
+        predictor.observe("eval", block_id)
+
+    for t in range(window, len(trace)):
+        start = time.perf_counter()
+        predicted = [block_id for block_id, _ in predictor.predict(trace[t - window:t], max(ks))]
+        elapsed += time.perf_counter() - start
+        for k in ks:
+            if trace[t] in predicted[:k]:
+                hits[k] += 1
+        predictor.observe("eval", trace[t])
+
+    total = max(1, len(trace) - window)
+    return {k: hits[k] / total for k in ks}, elapsed / total * 1e6
+
+def evaluate_scheduler(scheduler, trace, window, ks=(1, 3, 5, 10)):
+    """
+    Like evaluate_predictor, for a PrefetchScheduler that registers the
+    accesses itself, e.g. one running a tournament between backends.
+    """
+    hits = {k: 0 for k in ks}
+    elapsed = 0.0
+    # the scheduler logs every batch
+    with contextlib.redirect_stdout(io.StringIO()):
+        for t, block_id in enumerate(trace):
+            if t >= window:
+                start = time.perf_counter()
+                suggestions = scheduler.suggest_topk_batch(["eval"], k=max(ks), threshold=0.0)["eval"] or []
+                elapsed += time.perf_counter() - start
+                predicted = [b for b, _ in suggestions]
+                for k in ks:
+                    if block_id in predicted[:k]:
+                        hits[k] += 1
+            scheduler.register_access("eval", block_id)
+
+    total = max(1, len(trace) - window)
+    return {k: hits[k] / total for k in ks}, elapsed / total * 1e6
+
+def lstm_latency_us(model, X, samples=200, device="cpu"):
+    """Microseconds of one single window prediction."""
+    lengths = torch.tensor([X.size(1)], dtype=torch.long).to(device)
+    n = min(samples, X.size(0))
+    with torch.no_grad():
+        start = time.perf_counter()
+        for i in range(n):
+            torch.sigmoid(model(X[i:i + 1].to(device), lengths))
+    return (time.perf_counter() - start) / max(1, n) * 1e6
+
+def evaluate_lstm(data):
+    """Top-k hit rates and latency of trained_model.pt on the dataset."""
     X = torch.tensor(data["inputs"], dtype=torch.long)
     Y = torch.tensor(data["labels"], dtype=torch.long)
     vocab_size = int(data["vocab_size"])
@@ -89,13 +166,46 @@ def main():
     top3 = topk_hit_rate(model, loader, k=3, device=device)
     top5 = topk_hit_rate(model, loader, k=5, device=device)
     top10 = topk_hit_rate(model, loader, k=10, device=device)
-    mrr = mean_reciprocal_rank(model, loader, device=device)
-    
-    print(f"\nTop-1 Hit Rate: {top1:.4f}")
-    print(f"Top-3 Hit Rate: {top3:.4f}")
-    print(f"Top-5 Hit Rate: {top5:.4f}")
-    print(f"Top-10 Hit Rate: {top10:.4f}")
-    # print(f"Mean Reciprocal Rank: {mrr:.4f}")
+    us = lstm_latency_us(model, X, device=device)
+
+    return [f"{top1:.4f}", f"{top3:.4f}", f"{top5:.4f}", f"{top10:.4f}", f"{us:.1f}"]
+
+def main():
+    # Load dataset
+    with open("training_dataset.json", "r") as f:
+        data = json.load(f)
+
+    trace = access_trace(data)
+    window = len(data["inputs"][0])
+    print(f"Evaluating on {len(trace) - window} accesses, window {window}")
+
+    rows = []
+    for name in PREDICTORS:
+        rates, us = evaluate_predictor(make_predictor(name), trace, window)
+        rows.append([name] + [f"{rates[k]:.4f}" for k in (1, 3, 5, 10)] + [f"{us:.1f}"])
+
+    if torch is None or not os.path.exists("trained_model.pt"):
+        print("torch or trained_model.pt not available, skipping the LSTM")
+        hybrid = PrefetchScheduler(predictor=list(PREDICTORS), max_history=window)
+    else:
+        rows.append(["lstm"] + evaluate_lstm(data))
+        # the LSTM was trained on these samples, the predictors were not
+        print("lstm hit rates are in-sample, measured on its training data")
+        hybrid = PrefetchScheduler.from_files(max_history=window, device="cpu", predictor=list(PREDICTORS))
+
+    # all backends competing per stream
+    rates, us = evaluate_scheduler(hybrid, trace, window)
+    rows.append(["tournament"] + [f"{rates[k]:.4f}" for k in (1, 3, 5, 10)] + [f"{us:.1f}"])
+    if hybrid.model is not None:
+        stats = hybrid.tournament_stats
+        print(f"tournament ran the LSTM for {stats['lstm_runs']} of "
+              f"{stats['lstm_runs'] + stats['lstm_skipped']} predictions")
+
+    print(tabulate(
+        rows,
+        headers=["predictor", "top-1", "top-3", "top-5", "top-10", "us / prediction"],
+        tablefmt="github",
+    ))
 
 if __name__ == "__main__":
     main()
@@ -74,6 +74,7 @@ class BlockMetadata:
         byte_length,
         statistics,
         compression_info,
+        bloom_filter_offset=None,
     ):
         self.table_id = table_id
         self.column_id = column_id
@@ -91,6 +92,9 @@ class BlockMetadata:
         self.statistics = statistics
         self.compression_info = compression_info
 
+        # offset of the parquet bloom filter for this column chunk, None if absent
+        self.bloom_filter_offset = bloom_filter_offset
+
         # usage counters for future ml and caching
         self.access_count = 0
         self.last_access_ts = 0
@@ -164,6 +168,7 @@ class MicroBlockIndex:
                     byte_length=col_meta.total_compressed_size,
                     statistics=stats,
                     compression_info=str(col_meta.compression),
+                    bloom_filter_offset=getattr(col_meta, "bloom_filter_offset", None),
                 )
 
                 self.add_block(block)
@@ -180,3 +185,52 @@ class MicroBlockIndex:
             if block.statistics is not None:
                 out[col_name] = block.statistics
         return out
+
+    def row_count_for_row_group(self, table_id, row_group_id):
+        """
+        returns the number of rows in that row group, 0 if unknown
+        """
+        col_map = self.by_row_group.get((table_id, row_group_id), {})
+        for block in col_map.values():
+            return block.row_end - block.row_start + 1
+        return 0
+
+    def bytes_for_row_group(self, table_id, row_group_id):
+        """
+        returns the compressed bytes read to load that row group, 0 if unknown
+        """
+        col_map = self.by_row_group.get((table_id, row_group_id), {})
+        return sum(block.byte_length for block in col_map.values())
+
+    def mark_row_group_access(self, table_id, row_group_id):
+        """
+        update the usage counters of every column block of that row group
+        """
+        for block in self.by_row_group.get((table_id, row_group_id), {}).values():
+            block.mark_access()
+
+    def usage_for_row_group(self, table_id, row_group_id):
+        """
+        returns (access_count, last_access_ts, ewma_usage) of that row group,
+        None if unknown
+        """
+        col_map = self.by_row_group.get((table_id, row_group_id), {})
+        for block in col_map.values():
+            return block.access_count, block.last_access_ts, block.ewma_usage
+        return None
+
+    def restore_row_group_usage(self, table_id, row_group_id, access_count, last_access_ts, ewma_usage):
+        """
+        set the usage counters of that row group, e.g. from a saved snapshot
+        """
+        for block in self.by_row_group.get((table_id, row_group_id), {}).values():
+            block.access_count = access_count
+            block.last_access_ts = last_access_ts
+            block.ewma_usage = ewma_usage
+
+    def has_bloom_filter(self, table_id, column_name):
+        """
+        True if every row group of that column carries a parquet bloom filter
+        """
+        blocks = self.by_column.get((table_id, column_name), [])
+        return bool(blocks) and all(b.bloom_filter_offset is not None for b in blocks)
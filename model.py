@@ -10,6 +10,7 @@ from torch.nn.utils.rnn import pad_sequence, pack_padded_sequence, pad_packed_se
 
 import os
 import json
+from typing import Optional, Tuple
 
 
 ############################################
@@ -167,6 +168,8 @@ class LSTMPrefetcher(nn.Module):
         num_tokens: vocabulary size (max index + 1)
         """
         super().__init__()
+        self.num_layers = num_layers
+        self.hidden_dim = hidden_dim
         self.embedding = nn.Embedding(num_tokens, embed_dim, padding_idx=0)
         self.lstm = nn.LSTM(
             input_size=embed_dim,
@@ -181,19 +184,115 @@ class LSTMPrefetcher(nn.Module):
         seqs: [B, T] Long
         lengths: [B] Long
         """
+        logits, _ = self.forward_with_state(seqs, lengths, None)
+        return logits  # [B, num_tokens]
+
+    @torch.jit.export
+    def forward_with_state(
+        self,
+        seqs,
+        lengths,
+        state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+    ) -> Tuple[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Like forward, but continues the sequences from state (h_0, c_0),
+        each [num_layers, B, H], instead of from zeros, and also returns
+        (h_n, c_n) of every sequence.
+        """
         embedded = self.embedding(seqs)   # [B, T, E]
 
         # Pack for dynamic lengths
         packed = pack_padded_sequence(
             embedded, lengths.cpu(), batch_first=True, enforce_sorted=False
         )
-        packed_out, (h_n, c_n) = self.lstm(packed)
+        packed_out, (h_n, c_n) = self.lstm(packed, state)
 
         # Use last hidden state from top layer: [B, H]
         last_hidden = h_n[-1]
 
         logits = self.fc(last_hidden)  # [B, num_tokens]
-        return logits
+        return logits, (h_n, c_n)
+
+    @torch.jit.export
+    def step(
+        self,
+        tokens,
+        state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Advance the LSTM by one token per sequence, without packing.
+        tokens: [B] Long
+        state: (h, c), each [num_layers, B, H], None starts from zeros
+        returns (h, c) after the token
+        """
+        embedded = self.embedding(tokens).unsqueeze(1)  # [B, 1, E]
+        _, state_n = self.lstm(embedded, state)
+        return state_n
+
+    @torch.jit.export
+    def predict_from_state(self, h):
+        """
+        h: [num_layers, B, H] hidden state, returns logits [B, num_tokens]
+        """
+        return self.fc(h[-1])
+
+
+def quantize_for_inference(model, quantize_lstm=False):
+    """
+    int8 dynamic quantization for CPU inference, weights are int8 and
+    activations stay float. By default only the output layer, the
+    largest matmul with one row per block. Quantizing the LSTM as well
+    makes single step() calls faster but replaying whole sequences
+    slower, it pays off for a stateful scheduler.
+    """
+    model = model.to("cpu").eval()
+    modules = {nn.Linear, nn.LSTM} if quantize_lstm else {nn.Linear}
+    return torch.ao.quantization.quantize_dynamic(model, modules, dtype=torch.qint8)
+
+
+def export_compiled_model(model, path, quantize=True, quantize_lstm=False):
+    """
+    Save model as a TorchScript archive, int8 quantized unless quantize
+    is False. PrefetchScheduler.from_files loads it without the model
+    class and prefers it over the fp32 weights it was exported from.
+    """
+    if quantize:
+        model = quantize_for_inference(model, quantize_lstm)
+    else:
+        model = model.to("cpu").eval()
+    scripted = torch.jit.script(model)
+    torch.jit.save(scripted, path)
+    return scripted
+
+
+def compiled_quantization(scripted):
+    """
+    (quantize, quantize_lstm) a TorchScript model was exported with, from
+    the types of its output layer and LSTM, so a model built from new
+    weights can be exported the same way.
+    """
+    def quantized(name):
+        module = getattr(scripted, name, None)
+        return module is not None and ".quantized." in module._c.qualified_name
+
+    return quantized("fc"), quantized("lstm")
+
+
+def compiled_model_path(model_path):
+    # trained_model.pt -> trained_model.int8.ts
+    root, _ = os.path.splitext(model_path)
+    return root + ".int8.ts"
+
+
+def is_torchscript_file(path):
+    """
+    True for a torch.jit.save archive, False for torch.save weights.
+    """
+    import zipfile
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return any(name.split("/")[1:2] == ["code"] for name in archive.namelist())
 
 
 ############################################
@@ -0,0 +1,168 @@
+# multiprocess_engine.py
+
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from access_logger import AccessLogger, GlobalHistory
+from prefetch_scheduler import PrefetchScheduler
+from shared_block_cache import SharedBlockCache
+
+
+# engine of the current worker process, built by _init_worker
+_engine = None
+
+
+def _init_worker(config: dict):
+    global _engine
+    from query_enginev5 import StorageEngineV5
+
+    block_cache = SharedBlockCache(config["cache_dir"], config["cache_bytes"])
+    partial_cache = None
+    if config["share_partials"]:
+        partial_cache = SharedBlockCache(
+            os.path.join(config["cache_dir"], "partials"), config["cache_bytes"]
+        )
+
+    _engine = StorageEngineV5(
+        config["parquet_path"],
+        config["table_name"],
+        block_cache=block_cache,
+        partial_cache=partial_cache,
+        cache_on_read=True,
+        **config["engine_kwargs"],
+    )
+    for name, path in config["tables"].items():
+        _engine.register_table(name, path)
+    print(f"[MultiProcessEngine] worker {os.getpid()} ready")
+
+
+def _run_in_worker(method: str, sql: str, kwargs: dict):
+    _engine.last_row_groups = []
+    result = getattr(_engine, method)(sql, **kwargs)
+    return result, list(_engine.last_row_groups)
+
+
+class MultiProcessEngine:
+    """
+    Serves queries from a pool of worker processes, one StorageEngineV5
+    each, so sqlglot parsing, pruning and the other Python side work of
+    concurrent queries run on several cores.
+
+    Workers share decoded blocks through a SharedBlockCache in cache_dir
+    (under /dev/shm when available): a block decoded by one worker is
+    written once as Arrow IPC and memory mapped by the others, so N
+    workers do not keep N copies of the cache. With share_partials the
+    per block partial aggregates are shared the same way.
+
+    Workers do not log accesses themselves. The row groups each query read
+    are sent back and recorded in history, access_logger and scheduler of
+    this process, where the prefetcher runs. A Prefetcher on
+    self.block_cache fills the cache for all workers.
+    """
+
+    def __init__(
+        self,
+        parquet_path: str,
+        table_name: str = "t1",
+        tables: Optional[Dict[str, str]] = None,
+        workers: Optional[int] = None,
+        cache_dir: Optional[str] = None,
+        cache_bytes: int = 1 << 30,
+        share_partials: bool = True,
+        scheduler: PrefetchScheduler | None = None,
+        history: GlobalHistory | None = None,
+        access_logger: AccessLogger | None = None,
+        **engine_kwargs,
+    ):
+        if cache_dir is None:
+            base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            cache_dir = os.path.join(base, f"microblock_cache_{os.getpid()}")
+
+        self.table_name = table_name
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_dir = cache_dir
+        self.scheduler = scheduler
+        self.history = history
+        self.access_logger = access_logger
+
+        self.block_cache = SharedBlockCache(cache_dir, cache_bytes)
+
+        config = {
+            "parquet_path": parquet_path,
+            "table_name": table_name,
+            "tables": dict(tables or {}),
+            "cache_dir": cache_dir,
+            "cache_bytes": cache_bytes,
+            "share_partials": share_partials,
+            "engine_kwargs": engine_kwargs,
+        }
+        # spawn, forking a process with DuckDB and torch threads is unsafe
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(config,),
+        )
+
+    def _submit(self, method: str, sql: str, kwargs: dict) -> Future:
+        inner = self.executor.submit(_run_in_worker, method, sql, kwargs)
+        outer = Future()
+
+        def done(f):
+            try:
+                result, row_groups = f.result()
+            except Exception as e:
+                outer.set_exception(e)
+                return
+            self._record(row_groups, kwargs.get("session", "GLOBAL"))
+            outer.set_result(result)
+
+        inner.add_done_callback(done)
+        return outer
+
+    def _record(self, row_groups: List[int], session: str):
+        if self.access_logger and row_groups:
+            self.access_logger.log(row_groups, session)
+
+        if self.history:
+            for rg in row_groups:
+                self.history.record(rg, session)
+
+        if self.scheduler:
+            for rg in row_groups:
+                self.scheduler.register_access(session, rg)
+
+    def submit(self, sql: str, **kwargs) -> Future:
+        """
+        Queue sql on a worker, the Future resolves to a DataFrame.
+        Takes the keyword arguments of StorageEngineV5.query.
+        """
+        return self._submit("query", sql, kwargs)
+
+    def submit_arrow(self, sql: str, **kwargs) -> Future:
+        """
+        Like submit, the Future resolves to an Arrow Table.
+        """
+        return self._submit("query_arrow", sql, kwargs)
+
+    def query(self, sql: str, **kwargs):
+        return self.submit(sql, **kwargs).result()
+
+    def query_arrow(self, sql: str, **kwargs):
+        return self.submit_arrow(sql, **kwargs).result()
+
+    def map(self, sqls: List[str], **kwargs) -> list:
+        """
+        Run several queries in parallel, results in the order of sqls.
+        """
+        futures = [self.submit(sql, **kwargs) for sql in sqls]
+        return [f.result() for f in futures]
+
+    def close(self, clear_cache: bool = False):
+        self.executor.shutdown(wait=True)
+        if clear_cache:
+            self.block_cache.clear()
+        self.block_cache.close()
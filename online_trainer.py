@@ -0,0 +1,310 @@
+# online_trainer.py
+
+import copy
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, TensorDataset
+
+from access_logger import GlobalHistory
+from evaluate_model import topk_hit_rate
+from model import (
+    LSTMPrefetcher,
+    compiled_model_path,
+    compiled_quantization,
+    export_compiled_model,
+    quantize_for_inference,
+)
+from prefetch_scheduler import PrefetchScheduler
+
+
+class OnlineTrainer:
+    """
+    Fine-tunes the scheduler's LSTM on the live access stream.
+
+    A background thread turns the accesses recorded in GlobalHistory into
+    (window blocks, next block) samples, per session, and keeps the last
+    buffer_size of them in a replay buffer. Every train_every new samples
+    it runs steps_per_round minibatches with the loss of retrain_model.py
+    on an fp32 copy of the model, sampled from the buffer without its
+    newest eval_size samples, which are held out. The fine-tuned weights
+    replace the scheduler's model (PrefetchScheduler.swap_model) only if
+    their top-k hit rate on the held out samples is at most tolerance
+    below the current model's. A scheduler running a TorchScript export
+    gets a TorchScript model quantized the same way again (output layer
+    only, or LSTM too).
+
+    The samples of the next round were seen by neither model, so it first
+    compares the swapped in weights with the ones they replaced and, with
+    auto_rollback, swaps back when the hit rate dropped by more than
+    tolerance. rollback() does the same by hand. With save_path, swapped
+    in weights are written there and exported next to it like
+    retrain_model.py does, so a restart keeps them.
+
+    The model's vocabulary is fixed, samples with blocks outside it are
+    skipped, new blocks still need training_set_generator.py and
+    retrain_model.py. The thread runs at the lowest CPU priority where
+    the OS allows it and sleeps step_pause seconds between minibatches.
+    Torch computes on its own intra-op worker threads, which that does
+    not renice, so the trainer sets torch's intra-op threads to
+    torch_threads (1: all training runs on the reniced thread). The
+    setting is process wide and applies to the scheduler's inference
+    too, which predicts one small batch at a time and gains little from
+    more threads. None leaves it alone.
+    """
+
+    def __init__(
+        self,
+        scheduler: PrefetchScheduler,
+        history: GlobalHistory,
+        model_path: Optional[str] = None,
+        window: int = 5,
+        buffer_size: int = 20000,
+        train_every: int = 512,
+        steps_per_round: int = 100,
+        batch_size: int = 32,
+        lr: float = 1e-3,
+        eval_size: int = 256,
+        k: int = 10,
+        tolerance: float = 0.01,
+        auto_rollback: bool = True,
+        step_pause: float = 0.0,
+        save_path: Optional[str] = None,
+        torch_threads: Optional[int] = 1,
+    ):
+        if scheduler.model is None:
+            raise ValueError("OnlineTrainer needs a scheduler with an LSTM model")
+
+        self.scheduler = scheduler
+        self.history = history
+        self.window = window
+        self.train_every = train_every
+        self.steps_per_round = steps_per_round
+        self.batch_size = batch_size
+        self.lr = lr
+        self.eval_size = eval_size
+        self.k = k
+        self.tolerance = tolerance
+        self.auto_rollback = auto_rollback
+        self.step_pause = step_pause
+        self.save_path = save_path
+        self.torch_threads = torch_threads
+
+        # the scheduler may run the TorchScript export, train fp32 weights
+        self.compiled = isinstance(scheduler.model, torch.jit.ScriptModule)
+        # its quantization, kept by swapped in models and saved exports
+        self.quantize, self.quantize_lstm = (
+            compiled_quantization(scheduler.model) if self.compiled else (True, False)
+        )
+        if not self.compiled:
+            self.model = copy.deepcopy(scheduler.model).to("cpu")
+        elif model_path is None:
+            raise ValueError("the scheduler runs a TorchScript model, pass its fp32 weights as model_path")
+        else:
+            self.model = LSTMPrefetcher(num_tokens=scheduler.vocab_size, embed_dim=16, hidden_dim=64, num_layers=1)
+            self.model.load_state_dict(torch.load(model_path, map_location="cpu"))
+        self.model.eval()
+        # scores weights without touching the training copy
+        self._scratch = copy.deepcopy(self.model)
+
+        self.criterion = nn.BCEWithLogitsLoss()
+        self.optimizer = torch.optim.Adam(self.model.parameters(), lr=lr)
+
+        self.buffer: deque = deque(maxlen=buffer_size)
+        # session -> access count already turned into samples
+        self._seen = {}
+        self._new_samples = 0
+
+        # weights the scheduler runs, and the model and weights it ran
+        # before the last swap, for rollback
+        self._live_weights = copy.deepcopy(self.model.state_dict())
+        self._previous_model = None
+        self._previous_weights = None
+        self._verify_swap = False
+        # a round and rollback() must not interleave
+        self._lock = threading.Lock()
+
+        self._thread = None
+        self._stop_flag = False
+        self.stats = {"samples": 0, "rounds": 0, "swaps": 0, "rejected": 0, "rollbacks": 0, "hit_rate": None}
+
+    # longest single wait, so stop() is noticed without new accesses
+    _POLL = 0.5
+
+    def _collect(self):
+        """Turn the accesses recorded since the last call into samples."""
+        versions = self.history.session_versions()
+        id2idx = self.scheduler.id2idx
+        for session, version in versions.items():
+            seen = self._seen.get(session, 0)
+            # a session that ended and started again counts from 0
+            new = version - seen if version >= seen else version
+            if new <= 0:
+                continue
+            seq = self.history.get_sequence(new + self.window, session=session)
+            for i in range(max(self.window, len(seq) - new), len(seq)):
+                tokens = [id2idx.get(block_id, 0) for block_id in seq[i - self.window:i + 1]]
+                if 0 in tokens:
+                    continue
+                self.buffer.append((tokens[:-1], tokens[-1]))
+                self._new_samples += 1
+                self.stats["samples"] += 1
+        self._seen = versions
+
+    def _tensors(self, samples: List[Tuple[List[int], int]]):
+        x = torch.tensor([s[0] for s in samples], dtype=torch.long)
+        y = torch.zeros(len(samples), self.scheduler.vocab_size, dtype=torch.float)
+        y[torch.arange(len(samples)), torch.tensor([s[1] for s in samples])] = 1.0
+        return x, y
+
+    def _hit_rate(self, weights, loader) -> float:
+        self._scratch.load_state_dict(weights)
+        return topk_hit_rate(self._scratch, loader, k=self.k)
+
+    def _inference_model(self):
+        model = copy.deepcopy(self.model).eval()
+        if not self.compiled:
+            return model
+        if self.quantize:
+            model = quantize_for_inference(model, self.quantize_lstm)
+        return torch.jit.script(model)
+
+    def _save(self, weights):
+        tmp_path = self.save_path + ".tmp"
+        torch.save(weights, tmp_path)
+        os.replace(tmp_path, self.save_path)
+        # newer than the weights, from_files keeps preferring it
+        export_compiled_model(
+            copy.deepcopy(self.model), compiled_model_path(self.save_path),
+            quantize=self.quantize, quantize_lstm=self.quantize_lstm,
+        )
+
+    def _train_round(self):
+        samples = list(self.buffer)
+        held_out, train = samples[-self.eval_size:], samples[:-self.eval_size]
+        if len(train) < self.batch_size:
+            return
+        self._new_samples = 0
+        loader = DataLoader(TensorDataset(*self._tensors(held_out)), batch_size=256)
+
+        live_rate = self._hit_rate(self._live_weights, loader)
+        if self._verify_swap:
+            self._verify_swap = False
+            previous_rate = self._hit_rate(self._previous_weights, loader)
+            print(f"[OnlineTrainer] swapped in model: hit rate {live_rate:.3f}, "
+                  f"the one it replaced {previous_rate:.3f} on new accesses")
+            if self.auto_rollback and live_rate < previous_rate - self.tolerance:
+                self._rollback()
+                live_rate = previous_rate
+
+        self.model.load_state_dict(self._live_weights)
+        self.model.train()
+        lengths = torch.full((self.batch_size,), self.window, dtype=torch.long)
+        for _ in range(self.steps_per_round):
+            if self._stop_flag:
+                self.model.eval()
+                return
+            x, y = self._tensors(random.sample(train, self.batch_size))
+            self.optimizer.zero_grad()
+            loss = self.criterion(self.model(x, lengths), y)
+            loss.backward()
+            self.optimizer.step()
+            if self.step_pause:
+                time.sleep(self.step_pause)
+        self.model.eval()
+
+        self.stats["rounds"] += 1
+        candidate = copy.deepcopy(self.model.state_dict())
+        candidate_rate = self._hit_rate(candidate, loader)
+        if candidate_rate < live_rate - self.tolerance:
+            self.stats["rejected"] += 1
+            self.stats["hit_rate"] = live_rate
+            self.model.load_state_dict(self._live_weights)
+            self.optimizer = torch.optim.Adam(self.model.parameters(), lr=self.lr)
+            print(f"[OnlineTrainer] round {self.stats['rounds']}: top-{self.k} hit rate "
+                  f"{live_rate:.3f} -> {candidate_rate:.3f} on {len(held_out)} held out samples, kept the current model")
+            return
+
+        self._previous_model = self.scheduler.swap_model(self._inference_model())
+        self._previous_weights = self._live_weights
+        self._live_weights = candidate
+        self._verify_swap = True
+        self.stats["swaps"] += 1
+        self.stats["hit_rate"] = candidate_rate
+        if self.save_path:
+            self._save(candidate)
+        print(f"[OnlineTrainer] round {self.stats['rounds']}: top-{self.k} hit rate "
+              f"{live_rate:.3f} -> {candidate_rate:.3f} on {len(held_out)} held out samples, swapped")
+
+    def _rollback(self) -> bool:
+        if self._previous_model is None:
+            return False
+        self.scheduler.swap_model(self._previous_model)
+        self._live_weights = self._previous_weights
+        self.model.load_state_dict(self._live_weights)
+        self.optimizer = torch.optim.Adam(self.model.parameters(), lr=self.lr)
+        self._previous_model = None
+        self._previous_weights = None
+        self._verify_swap = False
+        self.stats["rollbacks"] += 1
+        if self.save_path:
+            self._save(self._live_weights)
+        print("[OnlineTrainer] rolled back to the model before the last swap")
+        return True
+
+    def rollback(self) -> bool:
+        """
+        Put the model from before the last swap back into the scheduler.
+        Returns False when there is none (no swap yet, or rolled back).
+        """
+        with self._lock:
+            return self._rollback()
+
+    def _lower_priority(self):
+        # Linux schedules threads on their own, this renices only this one
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        # torch's worker threads would train at normal priority
+        if self.torch_threads is not None:
+            torch.set_num_threads(self.torch_threads)
+
+    def _run_loop(self):
+        self._lower_priority()
+        version = self.history.version
+        while not self._stop_flag:
+            try:
+                new_version = self.history.wait_for_access(version, self._POLL)
+                if new_version == version:
+                    continue
+                version = new_version
+                self._collect()
+                if self._new_samples >= self.train_every:
+                    with self._lock:
+                        self._train_round()
+            except Exception as e:
+                print(f"[OnlineTrainer] error in loop: {e}")
+                import traceback
+                traceback.print_exc()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_flag = False
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+        print("[OnlineTrainer] started")
+
+    def stop(self):
+        self._stop_flag = True
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        print("[OnlineTrainer] stopped")
@@ -0,0 +1,181 @@
+# predictors.py
+
+from collections import Counter, OrderedDict, deque
+from typing import Dict, List, Tuple
+
+
+class Predictor:
+    """
+    Next block predictor behind PrefetchScheduler, instead of the LSTM.
+
+    observe() is called with every block a stream (a scheduler query id
+    or session) accesses, predictors that learn update their tables
+    there. predict() returns up to k (block_id, confidence) pairs for the
+    accesses following history, most confident first, confidences in
+    [0, 1]. None of them needs torch.
+    """
+
+    name = "base"
+
+    def observe(self, stream: str, block_id: int):
+        pass
+
+    def predict(self, history: List[int], k: int = 10) -> List[Tuple[int, float]]:
+        raise NotImplementedError
+
+    def forget(self, stream: str):
+        pass
+
+
+class StridePredictor(Predictor):
+    """
+    Sequential scans and constant strides. Once the last min_repeats
+    deltas of the history are equal, the next k blocks along that stride
+    are predicted. Confidence grows with the number of repeats and falls
+    by decay per block ahead.
+    """
+
+    name = "stride"
+
+    def __init__(self, min_repeats: int = 2, decay: float = 0.9):
+        self.min_repeats = min_repeats
+        self.decay = decay
+
+    def predict(self, history, k=10):
+        if len(history) < self.min_repeats + 1:
+            return []
+
+        stride = history[-1] - history[-2]
+        if stride == 0:
+            return []
+        repeats = 0
+        for i in range(len(history) - 1, 0, -1):
+            if history[i] - history[i - 1] != stride:
+                break
+            repeats += 1
+        if repeats < self.min_repeats:
+            return []
+
+        base = 1.0 - 0.5 ** repeats
+        results = []
+        for step in range(1, k + 1):
+            block_id = history[-1] + stride * step
+            if block_id < 0:
+                break
+            results.append((block_id, base * self.decay ** (step - 1)))
+        return results
+
+
+class MarkovPredictor(Predictor):
+    """
+    Transition table from the last order blocks of a stream to the block
+    that followed, learned online from all streams. An unseen order 2
+    context backs off to order 1. Confidence is the observed transition
+    probability. At most max_contexts contexts are kept, the least
+    recently used is dropped first.
+    """
+
+    def __init__(self, order: int = 1, max_contexts: int = 100_000):
+        if order not in (1, 2):
+            raise ValueError(f"unsupported markov order {order}, use 1 or 2")
+        self.order = order
+        self.name = f"markov{order}"
+        self.max_contexts = max_contexts
+        # context tuple -> Counter of next blocks
+        self.tables = OrderedDict()
+        # stream -> its last order blocks
+        self.recent: Dict[str, deque] = {}
+
+    def _learn(self, context, block_id):
+        counts = self.tables.get(context)
+        if counts is None:
+            counts = self.tables[context] = Counter()
+            if len(self.tables) > self.max_contexts:
+                self.tables.popitem(last=False)
+        else:
+            self.tables.move_to_end(context)
+        counts[block_id] += 1
+
+    def observe(self, stream, block_id):
+        recent = self.recent.get(stream)
+        if recent is None:
+            recent = self.recent[stream] = deque(maxlen=self.order)
+        seq = tuple(recent)
+        for order in range(1, len(seq) + 1):
+            self._learn(seq[-order:], int(block_id))
+        recent.append(int(block_id))
+
+    def predict(self, history, k=10):
+        seq = tuple(history[-self.order:])
+        for order in range(len(seq), 0, -1):
+            counts = self.tables.get(seq[-order:])
+            if counts:
+                total = sum(counts.values())
+                return [(block_id, n / total) for block_id, n in counts.most_common(k)]
+        return []
+
+    def forget(self, stream):
+        self.recent.pop(stream, None)
+
+
+class DeltaCorrelationPredictor(Predictor):
+    """
+    Delta correlation (DCPT): the last two deltas of the history are
+    looked up in its earlier deltas, and the deltas that followed the
+    most recent match are replayed from the current block. Covers
+    repeating irregular patterns, e.g. a scan that reads blocks with gaps
+    of 1, 1, 5. Confidence is the share of the pair's earlier occurrences
+    followed by the same delta, falling by decay per block ahead.
+    """
+
+    name = "delta"
+
+    def __init__(self, decay: float = 0.9):
+        self.decay = decay
+
+    def predict(self, history, k=10):
+        if len(history) < 4:
+            return []
+
+        deltas = [b - a for a, b in zip(history, history[1:])]
+        key = (deltas[-2], deltas[-1])
+
+        # earlier occurrences of the pair that have a following delta,
+        # most recent first
+        matches = [
+            i for i in range(len(deltas) - 2, 0, -1)
+            if (deltas[i - 1], deltas[i]) == key
+        ]
+        if not matches:
+            return []
+        following = Counter(deltas[i + 1] for i in matches)
+        base = following[deltas[matches[0] + 1]] / len(matches)
+
+        results = []
+        block_id = history[-1]
+        start = matches[0] + 1
+        for step, delta in enumerate(deltas[start:start + k]):
+            block_id += delta
+            if block_id < 0:
+                break
+            results.append((block_id, base * self.decay ** step))
+        return results
+
+
+PREDICTORS = {
+    "stride": StridePredictor,
+    "markov1": lambda: MarkovPredictor(order=1),
+    "markov2": lambda: MarkovPredictor(order=2),
+    "delta": DeltaCorrelationPredictor,
+}
+
+
+def make_predictor(predictor) -> Predictor:
+    """
+    Predictor instance from a name in PREDICTORS or an already built one.
+    """
+    if isinstance(predictor, str):
+        if predictor not in PREDICTORS:
+            raise ValueError(f"unknown predictor {predictor}, use one of {sorted(PREDICTORS)}")
+        return PREDICTORS[predictor]()
+    return predictor
@@ -1,7 +1,10 @@
 # prefetch.py
 
+import heapq
+import itertools
+import threading
 import pyarrow.parquet as pq
-from typing import Optional
+from typing import Iterable, Optional
 from block_cache import BlockCache
 
 
@@ -9,16 +12,72 @@ class Prefetcher:
     """
     Responsible for turning ML predictions into real prefetched blocks.
     Uses PyArrow to load row groups and stores them in a BlockCache.
+
+    With workers > 0, submit() queues a block for a pool of that many
+    background threads instead of reading it on the caller's thread. The
+    queue holds at most max_queue blocks and hands out the most confident
+    first. cancel() drops queued blocks, the engine cancels every block a
+    query reads itself. While queries run (foreground_begin/_end, called
+    by the engine) the workers wait, so prefetch reads do not compete with
+    the query's own reads.
     """
 
-    def __init__(self, parquet_path: str, cache: BlockCache):
+    def __init__(
+        self,
+        parquet_path: str,
+        cache: BlockCache,
+        index=None,
+        table_name: str = "t1",
+        workers: int = 0,
+        max_queue: int = 64,
+    ):
         self.parquet_path = parquet_path
         self.pf = pq.ParquetFile(parquet_path)
         self.cache = cache
+        # MicroBlockIndex of the file, for the I/O size of a block
+        self.index = index
+        self.table_name = table_name
+
+        self.workers = workers
+        self.max_queue = max_queue
+        # heap of [-confidence, seq, block_id], block_id None once dropped
+        self._heap = []
+        self._queued = {}
+        self._seq = itertools.count()
+        self._foreground = 0
+        self._running = 0
+        self._cond = threading.Condition()
+        self._stop_flag = False
+        self._local = threading.local()
+        self.async_stats = {"queued": 0, "done": 0, "cancelled": 0, "dropped": 0, "backoffs": 0}
+
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"prefetch-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def block_bytes(self, block_id: int) -> int:
+        """
+        Compressed bytes read from disk to prefetch the block, the
+        byte_length of its column blocks.
+        """
+        if self.index is not None:
+            nbytes = self.index.bytes_for_row_group(self.table_name, block_id)
+            if nbytes:
+                return nbytes
+        # same numbers as BlockMetadata.byte_length, from the footer
+        try:
+            rg = self.pf.metadata.row_group(block_id)
+        except (IndexError, ValueError):
+            return 0
+        return sum(rg.column(i).total_compressed_size for i in range(rg.num_columns))
 
-    def prefetch_block(self, block_id: int) -> bool:
+    def prefetch_block(self, block_id: int, confidence: Optional[float] = None) -> bool:
         """
         Prefetch the given microblock (row_group_id) into cache.
+        The block is marked as prefetched, with the model confidence, so
+        the cache keeps it apart from demand loaded blocks.
 
         Returns:
             True if prefetched successfully.
@@ -29,8 +88,8 @@ class Prefetcher:
             return False
 
         try:
-            table = self.pf.read_row_group(block_id)
-            self.cache.put(block_id, table)
+            table = self._parquet_file().read_row_group(block_id)
+            self.cache.put(block_id, table, prefetched=True, confidence=confidence)
             print(f"[Prefetcher] prefetched block {block_id}")
             return True
 
@@ -38,6 +97,133 @@ class Prefetcher:
             print(f"[Prefetcher] prefetch error for block {block_id}: {e}")
             return False
 
-    def prefetch_many(self, block_ids):
+    def prefetch_many(self, block_ids, confidence: Optional[float] = None):
         for bid in block_ids:
-            self.prefetch_block(bid)
+            if self.workers:
+                self.submit(bid, confidence)
+            else:
+                self.prefetch_block(bid, confidence)
+
+    def _parquet_file(self) -> pq.ParquetFile:
+        # one handle per worker thread, ParquetFile is not thread safe
+        if threading.current_thread() is threading.main_thread() or not self.workers:
+            return self.pf
+        pf = getattr(self._local, "pf", None)
+        if pf is None:
+            pf = self._local.pf = pq.ParquetFile(self.parquet_path)
+        return pf
+
+    # ------------------------------------------------------------
+    # background workers
+    # ------------------------------------------------------------
+    def submit(self, block_id: int, confidence: Optional[float] = None) -> bool:
+        """
+        Queue block_id for the workers. Returns False if it is cached,
+        already queued with at least this confidence, the queue is full of
+        blocks at least as confident, or no workers run.
+        """
+        if not self.workers or self.cache.contains(block_id):
+            return False
+        priority = confidence if confidence is not None else 0.0
+
+        with self._cond:
+            entry = self._queued.get(block_id)
+            if entry is not None:
+                if -entry[0] >= priority:
+                    return False
+                # predicted again with more confidence, move it up
+                entry[2] = None
+            elif len(self._queued) >= self.max_queue:
+                least = max(self._queued.values(), key=lambda e: e[:2])
+                if -least[0] >= priority:
+                    # it would be the one to make room
+                    self.async_stats["dropped"] += 1
+                    return False
+            entry = [-priority, next(self._seq), block_id, confidence]
+            heapq.heappush(self._heap, entry)
+            self._queued[block_id] = entry
+            self.async_stats["queued"] += 1
+
+            if len(self._queued) > self.max_queue:
+                # full, the least confident block makes room
+                victim = max(self._queued, key=lambda b: self._queued[b][:2])
+                self._queued.pop(victim)[2] = None
+                self.async_stats["dropped"] += 1
+            self._cond.notify()
+        return True
+
+    def cancel(self, block_ids: Iterable[int]) -> int:
+        """
+        Drop queued prefetches of block_ids, e.g. blocks a query is
+        reading itself. Returns the number cancelled.
+        """
+        cancelled = 0
+        with self._cond:
+            for block_id in block_ids:
+                entry = self._queued.pop(block_id, None)
+                if entry is not None:
+                    entry[2] = None
+                    cancelled += 1
+            self.async_stats["cancelled"] += cancelled
+        if cancelled:
+            print(f"[Prefetcher] cancelled {cancelled} queued prefetches, a query reads them")
+        return cancelled
+
+    def foreground_begin(self):
+        with self._cond:
+            self._foreground += 1
+
+    def foreground_end(self):
+        with self._cond:
+            self._foreground = max(0, self._foreground - 1)
+            self._cond.notify_all()
+
+    def pending(self) -> int:
+        return len(self._queued)
+
+    def _next(self):
+        # most confident queued block once no query runs, None on stop
+        with self._cond:
+            while not self._stop_flag:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                if self._foreground:
+                    self.async_stats["backoffs"] += 1
+                    self._cond.wait_for(lambda: not self._foreground or self._stop_flag)
+                    continue
+                entry = heapq.heappop(self._heap)
+                del self._queued[entry[2]]
+                self._running += 1
+                return entry
+            return None
+
+    def _worker(self):
+        while True:
+            entry = self._next()
+            if entry is None:
+                return
+            try:
+                self.prefetch_block(entry[2], entry[3])
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self.async_stats["done"] += 1
+                    self._cond.notify_all()
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the queue is empty and no worker is reading.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queued and not self._running, timeout)
+
+    def close(self):
+        with self._cond:
+            self._stop_flag = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._threads = []
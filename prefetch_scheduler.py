@@ -1,37 +1,103 @@
 import json
+import os
+import threading
+from collections import OrderedDict, deque
 from typing import Dict, List, Optional, Tuple
-import torch
-import torch.nn.functional as F
-from model import LSTMPrefetcher
+from predictors import Predictor, make_predictor
+
+try:
+    import torch
+    from model import LSTMPrefetcher, compiled_model_path, is_torchscript_file
+except ImportError:
+    # only the LSTM needs torch, the predictors in predictors.py run without it
+    torch = None
 
 class PrefetchScheduler:
     """
     Tracks recent block accesses per query and uses an LSTM model
     to predict the next likely block to prefetch.
+
+    With predictor (a Predictor or a name in predictors.PREDICTORS:
+    stride, markov1, markov2, delta) instead of a model, suggestions come
+    from that predictor and torch is not needed.
+
+    With more than one backend, a model and a predictor or a list of
+    predictors, the backends compete per query, see _tournament_topk.
+
+    With num_blocks, the row group count of the table, block ids outside
+    [0, num_blocks) are never suggested, e.g. a stride running past the
+    end of the table. StorageEngineV5 sets it to its table's count when
+    it is None.
+
+    Like GlobalHistory, at most max_sessions queries are tracked, the
+    least recently active one is forgotten first, so short lived query
+    ids that never reach forget() do not pile up.
     """
     
     def __init__(
         self,
-        model: LSTMPrefetcher,
-        id2idx: Dict[int, int],
-        idx2id: Dict[int, int],
-        vocab_size: int,  # ✅ Added explicit vocab_size
+        model: Optional["LSTMPrefetcher"] = None,
+        id2idx: Optional[Dict[int, int]] = None,
+        idx2id: Optional[Dict[int, int]] = None,
+        vocab_size: int = 0,  # ✅ Added explicit vocab_size
         prefetch_threshold: float = 0.6,
         max_history: int = 64,
         device: str = "cpu",
+        stateful: bool = False,
+        predictor=None,
+        skip_confidence: float = 0.8,
+        tournament_window: int = 32,
+        lstm_probe_every: int = 8,
+        num_blocks: Optional[int] = None,
+        max_sessions: int = 1024,
     ):
-        self.model = model.to(device)
-        self.model.eval()
-        self.id2idx = id2idx
-        self.idx2id = idx2id
+        if model is None and predictor is None:
+            raise ValueError("PrefetchScheduler needs a model, a predictor or both")
+        self.model = None
+        if model is not None:
+            self.model = model.to(device)
+            self.model.eval()
+        if predictor is None:
+            predictor = []
+        elif not isinstance(predictor, (list, tuple)):
+            predictor = [predictor]
+        self.predictors: Dict[str, Predictor] = {p.name: p for p in map(make_predictor, predictor)}
+        self.id2idx = id2idx or {}
+        self.idx2id = idx2id or {}
         self.vocab_size = vocab_size  # ✅ Store vocab_size
         self.prefetch_threshold = prefetch_threshold
         self.max_history = max_history
         self.device = device
-        self.query_history: Dict[str, List[int]] = {}
+        self.num_blocks = num_blocks
+        self.max_sessions = max_sessions
+        # least recently active query first
+        self.query_history: Dict[str, List[int]] = OrderedDict()
         
         #  Add UNK token handling
         self.UNK_IDX = 0  # Padding/unknown token
+
+        # per query: LSTM state after the tokens fed so far, and the
+        # tokens registered since, see suggest_topk_batch
+        self._states: Dict[str, dict] = {}
+        self._pending: Dict[str, List[int]] = {}
+        # engine threads register accesses while the service predicts
+        self._lock = threading.Lock()
+        # advance the cached state of a query on every register_access,
+        # so a prediction only runs the output layer
+        self.stateful = stateful
+
+        # more than one backend, the LSTM is the backend "lstm"
+        self.tournament = len(self.predictors) + (self.model is not None) > 1
+        self.skip_confidence = skip_confidence
+        self.tournament_window = tournament_window
+        self.lstm_probe_every = lstm_probe_every
+        # query -> backend -> 1 / 0 per access, hit or miss of its suggestions
+        self._scores: Dict[str, Dict[str, deque]] = {}
+        # query -> backend -> suggested blocks not accessed yet
+        self._issued: Dict[str, Dict[str, set]] = {}
+        # query -> predictions in a row that skipped the LSTM
+        self._skipped: Dict[str, int] = {}
+        self.tournament_stats = {"lstm_runs": 0, "lstm_skipped": 0}
     
     @classmethod
     def from_files(
@@ -41,10 +107,34 @@ class PrefetchScheduler:
         prefetch_threshold: float = 0.6,
         max_history: int = 64,
         device: Optional[str] = None,
+        stateful: bool = False,
+        prefer_compiled: bool = True,
+        predictor=None,
+        num_blocks: Optional[int] = None,
+        max_sessions: int = 1024,
     ) -> "PrefetchScheduler":
-        """Factory to construct scheduler from saved model and mappings."""
+        """
+        Factory to construct scheduler from saved model and mappings.
+
+        model_path may be fp32 weights or a TorchScript archive written by
+        retrain_model.py. With prefer_compiled, the int8 TorchScript model
+        exported next to the weights is loaded instead when it is at least
+        as new as they are. predictor adds predictors that compete with the
+        model, see _tournament_topk.
+        """
+        if torch is None:
+            raise ImportError("loading the LSTM model needs torch, use PrefetchScheduler(predictor=...) without it")
         if device is None:
             device = "cuda" if torch.cuda.is_available() else "cpu"
+
+        compiled_path = compiled_model_path(model_path)
+        if (
+            prefer_compiled
+            and not is_torchscript_file(model_path)
+            and os.path.exists(compiled_path)
+            and os.path.getmtime(compiled_path) >= os.path.getmtime(model_path)
+        ):
+            model_path = compiled_path
         
         with open(mapping_path, "r") as f:
             mapping = json.load(f)
@@ -61,16 +151,22 @@ class PrefetchScheduler:
         print(f"[Scheduler] Vocab size: {vocab_size}")
         print(f"[Scheduler] Block ID range: {min(id2idx.keys())} to {max(id2idx.keys())}")
         
-        #  Use vocab_size directly
-        model = LSTMPrefetcher(
-            num_tokens=vocab_size,
-            embed_dim=16,
-            hidden_dim=64,
-            num_layers=1,
-        )
-        
-        state_dict = torch.load(model_path, map_location=device)
-        model.load_state_dict(state_dict)
+        if is_torchscript_file(model_path):
+            # quantized kernels run on the CPU only
+            device = "cpu"
+            model = torch.jit.load(model_path, map_location=device)
+            print(f"[Scheduler] Loaded TorchScript model {model_path}")
+        else:
+            #  Use vocab_size directly
+            model = LSTMPrefetcher(
+                num_tokens=vocab_size,
+                embed_dim=16,
+                hidden_dim=64,
+                num_layers=1,
+            )
+            
+            state_dict = torch.load(model_path, map_location=device)
+            model.load_state_dict(state_dict)
         
         return cls(
             model=model,
@@ -80,25 +176,160 @@ class PrefetchScheduler:
             prefetch_threshold=prefetch_threshold,
             max_history=max_history,
             device=device,
+            stateful=stateful,
+            predictor=predictor,
+            num_blocks=num_blocks,
+            max_sessions=max_sessions,
         )
     
     def register_access(self, query_id: str, block_id: int) -> None:
         """Register block access for query history."""
-        history = self.query_history.setdefault(query_id, [])
-        history.append(int(block_id))
-        if len(history) > self.max_history:
-            self.query_history[query_id] = history[-self.max_history:]
+        with self._lock:
+            history = self.query_history.get(query_id)
+            if history is None:
+                history = self.query_history[query_id] = []
+                if len(self.query_history) > self.max_sessions:
+                    self._forget(next(iter(self.query_history)))
+            self.query_history.move_to_end(query_id)
+            history.append(int(block_id))
+            if len(history) > self.max_history:
+                self.query_history[query_id] = history[-self.max_history:]
+
+            if self.tournament:
+                self._score(query_id, int(block_id))
+            for predictor in self.predictors.values():
+                predictor.observe(query_id, int(block_id))
+            if self.model is None:
+                return
+
+            idx = self.id2idx.get(int(block_id), self.UNK_IDX)
+            if idx == self.UNK_IDX:
+                return
+            if self.stateful:
+                self._step(query_id, idx)
+                return
+            pending = self._pending.setdefault(query_id, [])
+            pending.append(idx)
+            if len(pending) > self.max_history:
+                # more than a re-encode from the last max_history blocks
+                # would feed, drop the state so the next prediction does that
+                del self._pending[query_id]
+                self._states.pop(query_id, None)
+
+    def _step(self, query_id: str, idx: int) -> None:
+        """
+        Advance the cached LSTM state of query_id by one token. A query
+        without state, or max_history steps past its last full encoding,
+        is encoded from its last max_history blocks instead.
+        """
+        state = self._states.get(query_id)
+        with torch.no_grad():
+            if state is None or state["since"] >= self.max_history:
+                tokens = self._encode_sequence(self.query_history[query_id])
+                if tokens is None:
+                    return
+                _, (h, c) = self.model.forward_with_state(
+                    torch.tensor([tokens], dtype=torch.long, device=self.device),
+                    torch.tensor([len(tokens)], dtype=torch.long),
+                )
+                since = 0
+            else:
+                h, c = self.model.step(
+                    torch.tensor([idx], dtype=torch.long, device=self.device),
+                    (state["h"].unsqueeze(1), state["c"].unsqueeze(1)),
+                )
+                since = state["since"] + 1
+        self._states[query_id] = {"h": h[:, 0], "c": c[:, 0], "since": since}
+
+    def forget(self, query_id: str) -> None:
+        """Drop history and cached LSTM state of a finished query."""
+        with self._lock:
+            self._forget(query_id)
+
+    def _forget(self, query_id: str) -> None:
+        self.query_history.pop(query_id, None)
+        self._states.pop(query_id, None)
+        self._pending.pop(query_id, None)
+        self._scores.pop(query_id, None)
+        self._issued.pop(query_id, None)
+        self._skipped.pop(query_id, None)
+        for predictor in self.predictors.values():
+            predictor.forget(query_id)
+
+    def swap_model(self, model) -> "LSTMPrefetcher":
+        """
+        Replace the LSTM, e.g. with weights fine-tuned by OnlineTrainer,
+        and return the previous one. Cached LSTM states belong to the old
+        weights and are dropped, queries are encoded again from their
+        history on their next prediction. Predictions already running
+        finish on the model they started with.
+        """
+        model = model.to(self.device)
+        model.eval()
+        with self._lock:
+            previous = self.model
+            self.model = model
+            self._states.clear()
+            self._pending.clear()
+        return previous
+
+    def _score(self, query_id: str, block_id: int) -> None:
+        """
+        Hit or miss of every backend that made suggestions for query_id,
+        its rolling hit rate over the last tournament_window accesses.
+        """
+        for backend, blocks in self._issued.get(query_id, {}).items():
+            hit = block_id in blocks
+            blocks.discard(block_id)
+            scores = self._scores.setdefault(query_id, {})
+            if backend not in scores:
+                scores[backend] = deque(maxlen=self.tournament_window)
+            scores[backend].append(1 if hit else 0)
+
+    def _valid_block(self, block_id: int) -> bool:
+        return self.num_blocks is None or 0 <= block_id < self.num_blocks
+
+    def _hit_rate(self, query_id: str, backend: str) -> float:
+        # starts at 0.5 and moves to the observed rate with more accesses
+        record = self._scores.get(query_id, {}).get(backend, ())
+        return (sum(record) + 1) / (len(record) + 2)
     
     def suggest_topk_prefetch(
         self,
         query_id: str,
         sequence: Optional[List[int]] = None,
         k: int = 10,
-        exclude_blocks: Optional[set] = None
+        exclude_blocks: Optional[set] = None,
+        threshold: Optional[float] = None
     ) -> Optional[List[Tuple[int, float]]]:
         """
         Returns top-K blocks using SIGMOID (multi-label).
+        Blocks below threshold (prefetch_threshold by default) are dropped.
         """
+        if threshold is None:
+            threshold = self.prefetch_threshold
+
+        if self.tournament:
+            return self._tournament_topk([query_id], k, exclude_blocks, threshold, sequence)[query_id]
+        if self.model is None:
+            predictor = next(iter(self.predictors.values()))
+            return self._predict_topk(predictor, query_id, sequence, k, exclude_blocks, threshold)
+        return self._model_topk(query_id, sequence, k, exclude_blocks, threshold)
+
+    def _model_topk(self, query_id, sequence, k, exclude_blocks, threshold):
+        """Top-K of the LSTM for one query, see suggest_topk_prefetch."""
+        if sequence is None and self.stateful:
+            with self._lock:
+                state = self._states.get(query_id)
+                model = self.model
+            if state is not None:
+                # one output layer on the state kept by register_access
+                with torch.no_grad():
+                    logits = model.predict_from_state(state["h"].unsqueeze(1))
+                    logits[:, 0] = -1e9
+                    probs = torch.sigmoid(logits)
+                return self._select_topk(probs[0], k, exclude_blocks, threshold)
+
         if sequence is not None:
             history = sequence
         else:
@@ -127,13 +358,21 @@ class PrefetchScheduler:
             # Use sigmoid for multi-label
             probs = torch.sigmoid(logits)  # [1, vocab_size]
         
+        return self._select_topk(probs[0], k, exclude_blocks, threshold)
+
+    def _select_topk(self, probs, k, exclude_blocks, threshold, verbose: bool = True):
+        """
+        Top-K (block_id, probability) of one row of probabilities, skipping
+        padding, unknown and excluded blocks and stopping below threshold.
+        """
         # Get top-K predictions
-        topk_probs, topk_indices = torch.topk(probs[0], k=min(k, probs.size(1)))
+        topk_probs, topk_indices = torch.topk(probs, k=min(k, probs.size(0)))
         
         exclude_set = exclude_blocks or set()
         results = []
         
-        print(f"[Scheduler DEBUG] Raw top-{k} probabilities (sigmoid):")
+        if verbose:
+            print(f"[Scheduler DEBUG] Raw top-{k} probabilities (sigmoid):")
         for i, (prob, idx) in enumerate(zip(topk_probs, topk_indices)):
             confidence = float(prob.item())
             pred_idx = int(idx.item())
@@ -142,25 +381,240 @@ class PrefetchScheduler:
             if pred_idx == 0:
                 continue
             
+            # Sorted by probability, the rest is below threshold too
+            if confidence < threshold:
+                if verbose:
+                    print(f"  Rank {i+1}: prob={confidence:.6f} below threshold {threshold:.3f}, stopping")
+                break
+            
             # Convert index to block ID
             block_id = self.idx2id.get(pred_idx)
             if block_id is None:
-                print(f"  Rank {i+1}: idx={pred_idx} NOT IN VOCAB")
+                if verbose:
+                    print(f"  Rank {i+1}: idx={pred_idx} NOT IN VOCAB")
+                continue
+
+            if not self._valid_block(block_id):
+                if verbose:
+                    print(f"  Rank {i+1}: block={block_id} NOT IN TABLE")
                 continue
             
             # Skip cached blocks
             if block_id in exclude_set:
-                print(f"  Rank {i+1}: block={block_id} CACHED, skipping")
+                if verbose:
+                    print(f"  Rank {i+1}: block={block_id} CACHED, skipping")
                 continue
             
             results.append((block_id, confidence))
-            print(f"  Rank {i+1}: block={block_id}, prob={confidence:.6f}")
+            if verbose:
+                print(f"  Rank {i+1}: block={block_id}, prob={confidence:.6f}")
             
             if len(results) >= k:
                 break
         
-        print(f"[Scheduler DEBUG] Returning {len(results)} blocks")
+        if verbose:
+            print(f"[Scheduler DEBUG] Returning {len(results)} blocks")
+        return results if results else None
+
+    def _predict_topk(self, predictor, query_id, sequence, k, exclude_blocks, threshold):
+        """
+        Top-K (block_id, confidence) of predictor for a query's history
+        or the given sequence, filtered like _select_topk.
+        """
+        exclude_set = exclude_blocks or set()
+        with self._lock:
+            history = sequence if sequence is not None else self.query_history.get(query_id, [])
+            # ask for more, so excluded blocks do not cut the result short
+            predictions = predictor.predict(list(history), k + len(exclude_set))
+
+        results = []
+        for block_id, confidence in predictions:
+            # most confident first, the rest is below threshold too
+            if confidence < threshold:
+                break
+            if block_id in exclude_set or not self._valid_block(block_id):
+                continue
+            results.append((block_id, confidence))
+            if len(results) >= k:
+                break
         return results if results else None
+
+    def _tournament_topk(self, query_ids, k, exclude_blocks, threshold, sequence=None):
+        """
+        Top-K per query from all backends, tournament style.
+
+        Every predictor suggests its top-K. The LSTM is skipped when a
+        predictor that is at least as accurate on the query is confident,
+        its best suggestion reaching skip_confidence, except every
+        lstm_probe_every predictions, so the LSTM's hit rate stays
+        current. A backend's confidences are scaled by its rolling hit
+        rate on the query relative to the best backend, so the prefetch
+        budget goes to whichever is accurate now, then merged, filtered
+        by threshold and cut to K.
+        """
+        candidates = {query_id: {} for query_id in query_ids}
+        lstm_ids = []
+        for query_id in query_ids:
+            for name, predictor in self.predictors.items():
+                suggestions = self._predict_topk(predictor, query_id, sequence, k, exclude_blocks, 0.0)
+                candidates[query_id][name] = suggestions or []
+            if self.model is None:
+                continue
+
+            with self._lock:
+                lstm_rate = self._hit_rate(query_id, "lstm")
+                confident = any(
+                    suggestions
+                    and suggestions[0][1] >= self.skip_confidence
+                    and self._hit_rate(query_id, name) >= lstm_rate
+                    for name, suggestions in candidates[query_id].items()
+                )
+                skipped = self._skipped.get(query_id, 0) + 1
+                # untracked or forgotten queries keep no tournament state
+                tracked = query_id in self.query_history
+                if confident and skipped < self.lstm_probe_every:
+                    if tracked:
+                        self._skipped[query_id] = skipped
+                    # not asked this time, so not scored either
+                    self._issued.get(query_id, {}).pop("lstm", None)
+                    self.tournament_stats["lstm_skipped"] += 1
+                else:
+                    if tracked:
+                        self._skipped[query_id] = 0
+                    lstm_ids.append(query_id)
+
+        if lstm_ids:
+            self.tournament_stats["lstm_runs"] += len(lstm_ids)
+            if sequence is None:
+                lstm = self._model_topk_batch(lstm_ids, k, exclude_blocks, 0.0)
+            else:
+                lstm = {query_id: self._model_topk(query_id, sequence, k, exclude_blocks, 0.0) for query_id in lstm_ids}
+            for query_id, suggestions in lstm.items():
+                candidates[query_id]["lstm"] = suggestions or []
+
+        results = {}
+        with self._lock:
+            for query_id, backends in candidates.items():
+                rates = {name: self._hit_rate(query_id, name) for name in backends}
+                best = max(rates.values())
+                issued = self._issued.setdefault(query_id, {}) if query_id in self.query_history else {}
+                merged = {}
+                for name, suggestions in backends.items():
+                    issued[name] = {block_id for block_id, _ in suggestions}
+                    for block_id, confidence in suggestions:
+                        score = confidence * rates[name] / best
+                        if score > merged.get(block_id, 0.0):
+                            merged[block_id] = score
+                ranked = sorted(merged.items(), key=lambda item: item[1], reverse=True)
+                results[query_id] = [s for s in ranked if s[1] >= threshold][:k] or None
+        return results
+
+    def suggest_topk_batch(
+        self,
+        query_ids: List[str],
+        k: int = 10,
+        exclude_blocks: Optional[set] = None,
+        threshold: Optional[float] = None
+    ) -> Dict[str, Optional[List[Tuple[int, float]]]]:
+        """
+        Top-K blocks for many queries with one forward pass.
+
+        Each query keeps the LSTM state after the tokens it was last
+        predicted from, so only the accesses registered since are fed,
+        padded and packed into one batch together with the other queries.
+        Once max_history tokens were fed on top of a fresh encoding, the
+        query is encoded again from its last max_history blocks, which
+        keeps the state close to the windows the model was trained on.
+        Queries without enough known blocks map to None.
+        """
+        if threshold is None:
+            threshold = self.prefetch_threshold
+
+        if self.tournament:
+            return self._tournament_topk(query_ids, k, exclude_blocks, threshold)
+        if self.model is None:
+            # microseconds per query, nothing to batch
+            predictor = next(iter(self.predictors.values()))
+            return {
+                query_id: self._predict_topk(predictor, query_id, None, k, exclude_blocks, threshold)
+                for query_id in query_ids
+            }
+        return self._model_topk_batch(query_ids, k, exclude_blocks, threshold)
+
+    def _model_topk_batch(self, query_ids, k, exclude_blocks, threshold):
+        """Top-K of the LSTM for many queries, see suggest_topk_batch."""
+        # (query_id, tokens to feed, state or None for a fresh start)
+        feeds = []
+        # query_id -> cached state, nothing new to feed
+        ready = {}
+        with self._lock:
+            # swap_model() may replace it meanwhile, states belong to this one
+            model = self.model
+            for query_id in query_ids:
+                state = self._states.get(query_id)
+                pending = self._pending.get(query_id, [])
+                if state is not None and not pending:
+                    ready[query_id] = state
+                    continue
+                if state is None or state["since"] + len(pending) > self.max_history:
+                    tokens = self._encode_sequence(self.query_history.get(query_id, []))
+                    if tokens is None:
+                        continue
+                    state = None
+                else:
+                    tokens = pending
+                self._pending.pop(query_id, None)
+                feeds.append((query_id, tokens, state))
+
+        hidden = {}
+        if feeds:
+            num_layers = model.num_layers
+            hidden_dim = model.hidden_dim
+            lengths = torch.tensor([len(t) for _, t, _ in feeds], dtype=torch.long)
+            seqs = torch.zeros((len(feeds), int(lengths.max())), dtype=torch.long)
+            h_0 = torch.zeros((num_layers, len(feeds), hidden_dim))
+            c_0 = torch.zeros((num_layers, len(feeds), hidden_dim))
+            for i, (_, tokens, state) in enumerate(feeds):
+                seqs[i, :len(tokens)] = torch.tensor(tokens, dtype=torch.long)
+                if state is not None:
+                    h_0[:, i] = state["h"]
+                    c_0[:, i] = state["c"]
+
+            with torch.no_grad():
+                _, (h_n, c_n) = model.forward_with_state(
+                    seqs.to(self.device),
+                    lengths.to(self.device),
+                    (h_0.to(self.device), c_0.to(self.device)),
+                )
+
+            with self._lock:
+                for i, (query_id, tokens, state) in enumerate(feeds):
+                    # tokens fed incrementally since the last fresh encoding
+                    since = state["since"] + len(tokens) if state is not None else 0
+                    new_state = {"h": h_n[:, i], "c": c_n[:, i], "since": since}
+                    # forget() or swap_model() may have run meanwhile
+                    if query_id in self.query_history and self.model is model:
+                        self._states[query_id] = new_state
+                    hidden[query_id] = new_state["h"][-1]
+
+        for query_id, state in ready.items():
+            hidden[query_id] = state["h"][-1]
+
+        results = {query_id: None for query_id in query_ids}
+        if not hidden:
+            return results
+
+        order = list(hidden)
+        with torch.no_grad():
+            logits = model.predict_from_state(torch.stack([hidden[q] for q in order]).unsqueeze(0))
+            logits[:, 0] = -1e9  # Force pad to never be chosen
+            probs = torch.sigmoid(logits)
+
+        for row, query_id in enumerate(order):
+            results[query_id] = self._select_topk(probs[row], k, exclude_blocks, threshold, verbose=False)
+        print(f"[Scheduler] batch of {len(query_ids)} queries, fed {len(feeds)}, "
+              f"{sum(r is not None for r in results.values())} with suggestions")
+        return results
     
     def _encode_sequence(self, history: List[int]) -> Optional[List[int]]:
         """
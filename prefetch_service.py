@@ -9,10 +9,36 @@ from prefetch_scheduler import PrefetchScheduler
 
 class PrefetchService:
     """
-    Runs a periodic loop that:
-    - looks at recent block access history
+    Runs a background loop that:
+    - wakes up when new block accesses are recorded in GlobalHistory
     - asks the ML scheduler for next block to prefetch
     - triggers the Prefetcher to load that block into cache
+
+    A query records several accesses in a burst, so the service waits
+    until accesses pause for debounce seconds (but at most max_delay after
+    the first one) and predicts once for the whole burst. Two predictions
+    are at least min_gap seconds apart. With interval set it also predicts
+    when no access arrived for interval seconds.
+
+    Only suggestions with a confidence above threshold are prefetched.
+    It starts at the scheduler's prefetch_threshold and, with
+    adaptive_threshold, is recalibrated from the cache's prefetch log to
+    the cutoff below which fewer than target_usefulness of past
+    prefetches were used, recent prefetches weighing more (outcome_decay
+    per older one). Every explore_every runs, and on every run where no
+    suggestion reaches the threshold (e.g. it rose to max_threshold),
+    the most confident suggestion below it is prefetched too, so the log
+    keeps getting outcomes below the cutoff and it can come down again. With io_budget set, prefetches read at
+    most that many compressed bytes per second (token bucket over
+    BlockMetadata.byte_length), in the order slots are handed out. A
+    block the prefetcher turns down (cached, already queued) costs
+    nothing.
+
+    Every session (see StorageEngineV5.query) is predicted from its own
+    history, the sessions with new accesses on each run, or all sessions
+    active within session_ttl on a periodic run. A run prefetches at most
+    max_prefetches blocks, handed out round robin over the sessions with
+    a rotating start, so one busy session cannot take every slot.
     """
 
     def __init__(
@@ -20,66 +46,319 @@ class PrefetchService:
         history: GlobalHistory,
         scheduler: PrefetchScheduler,
         prefetcher: Prefetcher,
-        interval: int = 60,
+        interval: Optional[float] = None,
         history_len: int = 30,  # Remove min_confidence parameter
+        debounce: float = 0.005,
+        max_delay: float = 0.05,
+        min_gap: float = 0.02,
+        io_budget: Optional[int] = None,
+        adaptive_threshold: bool = True,
+        target_usefulness: float = 0.5,
+        min_threshold: float = 0.05,
+        max_threshold: float = 0.95,
+        calibration_window: int = 200,
+        calibration_min: int = 20,
+        outcome_decay: float = 0.99,
+        explore_every: int = 10,
+        max_prefetches: int = 10,
+        session_ttl: float = 300.0,
     ):
         self.history = history
         self.scheduler = scheduler
         self.prefetcher = prefetcher
         self.interval = interval
         self.history_len = history_len  # Remove self.min_confidence
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.min_gap = min_gap
         self._thread = None
         self._stop_flag = False
 
+        self.threshold = scheduler.prefetch_threshold
+        self.adaptive_threshold = adaptive_threshold
+        self.target_usefulness = target_usefulness
+        self.min_threshold = min_threshold
+        self.max_threshold = max_threshold
+        self.calibration_window = calibration_window
+        self.calibration_min = calibration_min
+        self.outcome_decay = outcome_decay
+        # 0 never prefetches below the threshold
+        self.explore_every = explore_every
+        self.explored = 0
+
+        # bytes per second, the bucket holds at most one second of budget
+        self.io_budget = io_budget
+        self._tokens = float(io_budget or 0)
+        self._tokens_at = time.monotonic()
+        self.skipped_budget = 0
+
+        self.max_prefetches = max_prefetches
+        self.session_ttl = session_ttl
+        # session -> access count at its last prediction
+        self._seen = {}
+
+        self.runs = 0
+        # seconds from the first access of a burst to its prefetches issued
+        self.last_latency = None
+        self._last_run = 0.0
+
+    # longest single wait, so stop() is noticed without new accesses
+    _POLL = 0.25
+
+    def _wait_for_trigger(self, version: int):
+        """
+        Wait for an access newer than version, or for interval to pass.
+        Returns (version, time of the first new access or None).
+        """
+        while not self._stop_flag:
+            timeout = self._POLL
+            if self.interval is not None:
+                due = self._last_run + self.interval - time.monotonic()
+                if due <= 0:
+                    return version, None
+                timeout = min(timeout, due)
+            new_version = self.history.wait_for_access(version, timeout)
+            if new_version != version:
+                return new_version, time.monotonic()
+        return version, None
+
+    def _debounce(self, version: int, first_seen: float) -> int:
+        # let the rest of the burst arrive
+        while not self._stop_flag:
+            remaining = self.max_delay - (time.monotonic() - first_seen)
+            if remaining <= 0:
+                break
+            new_version = self.history.wait_for_access(version, min(self.debounce, remaining))
+            if new_version == version:
+                break
+            version = new_version
+        return version
 
     def _run_loop(self):
         """
         Internal loop that runs forever (until stop is called).
         """
+        version = self.history.version
         while not self._stop_flag:
             try:
-                # get recent sequence from history
-                seq = self.history.get_sequence(self.history_len)
-                if not seq:
-                    print("[PrefetchService] no history yet, skipping this cycle")
-                else:
-                    print(f"[PrefetchService] got sequence of length {len(seq)} from GlobalHistory")
-                    
-                    # Get cached block IDs to exclude from predictions
-                    cached_blocks = set(self.prefetcher.cache.cache.keys()) if hasattr(self.prefetcher.cache, 'cache') else set()
-                    
-                    # Get top-10 predictions, excluding already-cached blocks
-                    suggestions = self.scheduler.suggest_topk_prefetch(
-                        "GLOBAL", 
-                        sequence=seq,
-                        k=10,
-                        exclude_blocks=cached_blocks  # ✅ Use new parameter
-                    )
-                    
-                    if suggestions is None:
-                        print("[PrefetchService] scheduler returned no suggestions")
-                    else:
-                        print(f"[PrefetchService] got {len(suggestions)} suggestions")
-                        
-                        # Prefetch all suggested blocks
-                        prefetched_count = 0
-                        for block_id, confidence in suggestions:
-                            print(f"[PrefetchService] trying block={block_id}, confidence={confidence:.3f}")
-                            prefetched = self.prefetcher.prefetch_block(block_id)
-                            if prefetched:
-                                prefetched_count += 1
-                        
-                        print(f"[PrefetchService] prefetched {prefetched_count}/{len(suggestions)} blocks")
-                
-                time.sleep(self.interval)
-                
+                version, first_seen = self._wait_for_trigger(version)
+                if self._stop_flag:
+                    break
+                if first_seen is not None:
+                    self._debounce(version, first_seen)
+
+                # rate limit, accesses arriving meanwhile join this run
+                gap = self.min_gap - (time.monotonic() - self._last_run)
+                if gap > 0:
+                    time.sleep(gap)
+
+                # accesses recorded from here on trigger the next run
+                version = self.history.version
+                self._last_run = time.monotonic()
+                self._predict_and_prefetch()
+
+                self.runs += 1
+                if first_seen is not None:
+                    self.last_latency = time.monotonic() - first_seen
+                    print(f"[PrefetchService] prefetches issued {self.last_latency * 1000:.1f} ms after the access")
+
             except Exception as e:
                 print(f"[PrefetchService] error in loop: {e}")
                 import traceback
                 traceback.print_exc()
-                time.sleep(self.interval)
+                self._last_run = time.monotonic()
+
+    def _calibrate(self):
+        """
+        Move threshold towards the cutoff that past prefetches say pays
+        off best: each prefetch above it scores 1 - target_usefulness when
+        used and -target_usefulness when wasted, and the cutoff with the
+        highest total wins. Confidences where less than target_usefulness
+        of the prefetches were used fall below it. A prefetch counts
+        outcome_decay times less than the one after it, so fresh outcomes
+        of explored blocks can outweigh a window of stale ones.
+        """
+        outcomes = getattr(self.prefetcher.cache, "prefetch_outcomes", None)
+        if not self.adaptive_threshold or outcomes is None:
+            return
+        recent = outcomes(self.calibration_window)
+        # newest last, weight 1
+        records = [
+            (c, used, self.outcome_decay ** age)
+            for age, (c, used) in enumerate(reversed(recent)) if c is not None
+        ]
+        if len(records) < self.calibration_min:
+            return
+
+        records.sort(key=lambda r: r[0], reverse=True)
+        # not even the most confident ones pay off
+        calibrated = self.max_threshold
+        score = best = 0.0
+        for confidence, was_used, weight in records:
+            score += weight * (bool(was_used) - self.target_usefulness)
+            if score > best:
+                best = score
+                calibrated = confidence
+
+        # half way each run, one noisy window does not swing it
+        threshold = (self.threshold + calibrated) / 2
+        threshold = min(self.max_threshold, max(self.min_threshold, threshold))
+        if abs(threshold - self.threshold) >= 0.01:
+            print(f"[PrefetchService] threshold {self.threshold:.3f} -> {threshold:.3f}")
+        self.threshold = threshold
+
+    def _take_budget(self, nbytes: int) -> bool:
+        # token bucket over compressed bytes read
+        if self.io_budget is None:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.io_budget, self._tokens + (now - self._tokens_at) * self.io_budget)
+        self._tokens_at = now
+        # a block larger than the whole budget goes when the bucket is full
+        if nbytes > self._tokens and self._tokens < self.io_budget:
+            return False
+        self._tokens -= nbytes
+        return True
+
+    def _refund_budget(self, nbytes: int):
+        # taken for a read that was not issued
+        if self.io_budget is not None:
+            self._tokens = min(self.io_budget, self._tokens + nbytes)
+
+    def _sessions_to_predict(self):
+        versions = self.history.session_versions(self.session_ttl)
+        changed = [session for session, v in versions.items() if self._seen.get(session) != v]
+        self._seen = versions
+        # periodic run without new accesses, refresh every active session
+        return changed or list(versions)
+
+    def _allocate(self, per_session):
+        """
+        Round robin over the sessions' suggestions, most confident of each
+        first, until max_prefetches blocks are picked.
+        """
+        sessions = list(per_session)
+        if sessions:
+            start = self.runs % len(sessions)
+            sessions = sessions[start:] + sessions[:start]
+
+        picks = []
+        seen = set()
+        rank = 0
+        while len(picks) < self.max_prefetches:
+            added = False
+            for session in sessions:
+                suggestions = per_session[session]
+                if rank < len(suggestions):
+                    added = True
+                    block_id, confidence = suggestions[rank]
+                    if block_id not in seen:
+                        seen.add(block_id)
+                        picks.append((session, block_id, confidence))
+                        if len(picks) >= self.max_prefetches:
+                            break
+            if not added:
+                break
+            rank += 1
+        return picks
+
+    def _predict_and_prefetch(self):
+        sessions = self._sessions_to_predict()
+        if not sessions:
+            print("[PrefetchService] no history yet, skipping this cycle")
+            return
+
+        # Get cached block IDs to exclude from predictions
+        cached_blocks = set(self.prefetcher.cache.cache.keys()) if hasattr(self.prefetcher.cache, 'cache') else set()
+
+        self._calibrate()
+        # ask for suggestions below the threshold too, one may be explored
+        threshold = self.min_threshold if self.explore_every else self.threshold
+
+        batch = getattr(self.scheduler, "suggest_topk_batch", None)
+        if batch is not None:
+            # one forward pass for all sessions, from the scheduler's own
+            # per session history and cached LSTM states
+            results = batch(
+                sessions,
+                k=self.max_prefetches,
+                exclude_blocks=cached_blocks,
+                threshold=threshold
+            )
+            per_session = {
+                session: sorted(suggestions, key=lambda s: -s[1])
+                for session, suggestions in results.items() if suggestions
+            }
+        else:
+            per_session = {}
+            for session in sessions:
+                # get recent sequence of this session from history
+                seq = self.history.get_sequence(self.history_len, session)
+                if not seq:
+                    continue
+                print(f"[PrefetchService] got sequence of length {len(seq)} for session {session}")
+
+                # Get top predictions above threshold, excluding already-cached blocks
+                suggestions = self.scheduler.suggest_topk_prefetch(
+                    session,
+                    sequence=seq,
+                    k=self.max_prefetches,
+                    exclude_blocks=cached_blocks,  # ✅ Use new parameter
+                    threshold=threshold
+                )
+                if suggestions:
+                    per_session[session] = sorted(suggestions, key=lambda s: -s[1])
+
+        explored = None
+        if self.explore_every:
+            below = [
+                (confidence, block_id, session)
+                for session, suggestions in per_session.items()
+                for block_id, confidence in suggestions
+                if confidence < self.threshold
+            ]
+            per_session = {
+                session: [s for s in suggestions if s[1] >= self.threshold]
+                for session, suggestions in per_session.items()
+            }
+            per_session = {session: s for session, s in per_session.items() if s}
+            due = self.runs % self.explore_every == self.explore_every - 1
+            if below and (due or not per_session):
+                confidence, block_id, session = max(below, key=lambda s: s[0])
+                explored = (session, block_id, confidence)
+
+        if not per_session and explored is None:
+            print("[PrefetchService] scheduler returned no suggestions")
+            return
+        picks = self._allocate(per_session)
+        if explored is not None and explored[1] not in {block_id for _, block_id, _ in picks}:
+            picks.append(explored)
+            self.explored += 1
+            print(f"[PrefetchService] exploring block={explored[1]} below threshold {self.threshold:.3f}")
+        print(f"[PrefetchService] got {len(picks)} suggestions from {len(per_session)} sessions")
 
+        # Prefetch the picked blocks in turn, within the I/O budget
+        prefetched_count = 0
+        for n, (session, block_id, confidence) in enumerate(picks):
+            nbytes = self.prefetcher.block_bytes(block_id) if self.io_budget is not None else 0
+            if not self._take_budget(nbytes):
+                skipped = len(picks) - n
+                self.skipped_budget += skipped
+                print(f"[PrefetchService] I/O budget used up, skipping {skipped} blocks")
+                break
+            print(f"[PrefetchService] trying block={block_id}, confidence={confidence:.3f}, session={session}")
+            if getattr(self.prefetcher, "workers", 0):
+                # background workers read it, most confident first
+                prefetched = self.prefetcher.submit(block_id, confidence)
+            else:
+                prefetched = self.prefetcher.prefetch_block(block_id, confidence)
+            if prefetched:
+                prefetched_count += 1
+            else:
+                self._refund_budget(nbytes)
 
+        action = "queued" if getattr(self.prefetcher, "workers", 0) else "prefetched"
+        print(f"[PrefetchService] {action} {prefetched_count}/{len(picks)} blocks")
 
     def start(self):
         if self._thread is not None:
@@ -87,10 +366,11 @@ class PrefetchService:
         self._stop_flag = False
         self._thread = threading.Thread(target=self._run_loop, daemon=True)
         self._thread.start()
-        print("[PrefetchService] started periodic predictor")
+        print("[PrefetchService] started event driven predictor")
 
     def stop(self):
         self._stop_flag = True
         if self._thread:
             self._thread.join(timeout=2.0)
-        print("[PrefetchService] stopped")
\ No newline at end of file
+            self._thread = None
+        print("[PrefetchService] stopped")
@@ -1,10 +1,17 @@
 # query_engine_v5.py
 
+import bisect
+import math
+import random
+import threading
+from statistics import NormalDist
+
 import duckdb
+import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
 
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 import sqlglot
 from sqlglot import exp
@@ -12,9 +19,64 @@ from sqlglot import exp
 from microblock_index import MicroBlockIndex
 from access_logger import AccessLogger, GlobalHistory
 from block_cache import BlockCache
+from block_pipeline import BlockPipeline
+from cursor_pool import CursorPool, PooledCursor
+from prefetch import Prefetcher
 from prefetch_scheduler import PrefetchScheduler
 
 
+# const <op> col rewritten as col <op> const
+_FLIPPED_COMPARISONS = {
+    exp.EQ: exp.EQ,
+    exp.NEQ: exp.NEQ,
+    exp.GT: exp.LT,
+    exp.GTE: exp.LTE,
+    exp.LT: exp.GT,
+    exp.LTE: exp.GTE,
+}
+
+
+def _t_quantile(confidence: float, df: int) -> float:
+    """
+    t such that P(|T| < t) = confidence for Student's t with df degrees of
+    freedom, by bisection on its closed form CDF for integer df. The
+    normal quantile when there are none.
+    """
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    if df < 1:
+        return z
+
+    def central(t):
+        # P(|T| < t)
+        theta = math.atan(t / math.sqrt(df))
+        c2 = math.cos(theta) ** 2
+        if df % 2 == 1:
+            series = 0.0
+            if df > 1:
+                term = series = 1.0
+                for k in range(2, df - 1, 2):
+                    term *= k / (k + 1) * c2
+                    series += term
+            return 2 / math.pi * (theta + math.sin(theta) * math.cos(theta) * series)
+        term = series = 1.0
+        for k in range(1, df - 2, 2):
+            term *= k / (k + 1) * c2
+            series += term
+        return math.sin(theta) * series
+
+    # t is at least z, widen until it is enclosed
+    lo, hi = z, 2 * z
+    while central(hi) < confidence:
+        lo, hi = hi, 2 * hi
+    for _ in range(60):
+        mid = (lo + hi) / 2
+        if central(mid) < confidence:
+            lo = mid
+        else:
+            hi = mid
+    return hi
+
+
 class StorageEngineV5:
     """
     Cache aware microblock storage engine.
@@ -25,6 +87,29 @@ class StorageEngineV5:
       - uses BlockCache to reuse prefetched microblocks
       - logs access and updates GlobalHistory and PrefetchScheduler
       - runs queries inside DuckDB on a merged Arrow table
+
+    More microblock tables can be added with register_table. Each table
+    referenced by a query is pruned on its own predicates, and inner
+    equi-joins pass the join key min max of the smaller side into the
+    pruning of the larger side. When the smaller side is small enough it
+    is executed first, and its distinct join keys prune the larger side
+    against block min max stats and parquet bloom filters.
+
+    With a partial_cache, GROUP BY queries over one table keep per block
+    partial aggregates and only compute the blocks they have not seen.
+
+    With pipeline_depth > 0, a table scanned once by a query is not
+    merged up front. A BlockPipeline loads its blocks on a background
+    thread while DuckDB consumes them as a stream.
+
+    The table passed to the constructor is the primary table. Only its
+    row groups feed the access log, history and scheduler, and they are
+    cached under the bare row group id the prefetcher uses. Blocks of the
+    other tables are cached under (table_name, row_group_id).
+
+    With a prefetcher running background workers, its workers wait while
+    queries run and queued prefetches of blocks a query reads are
+    cancelled.
     """
 
     def __init__(
@@ -35,66 +120,453 @@ class StorageEngineV5:
         history: GlobalHistory | None = None,
         access_logger: AccessLogger | None = None,
         block_cache: BlockCache | None = None,
+        partial_cache: BlockCache | None = None,
+        dynamic_filter_max_rows: int = 100_000,
+        bloom_probe_max_values: int = 32,
+        pipeline_depth: int = 0,
+        pool_size: int = 4,
+        cache_on_read: bool = False,
+        prefetcher: Prefetcher | None = None,
     ):
         self.parquet_path = parquet_path
         self.table_name = table_name
 
+        # build sides up to this many candidate rows are executed first to
+        # collect their join keys, 0 disables runtime dynamic filters
+        self.dynamic_filter_max_rows = dynamic_filter_max_rows
+        # probe parquet bloom filters only for key sets up to this size
+        self.bloom_probe_max_values = bloom_probe_max_values
+        # blocks a background loader may queue ahead of DuckDB, 0 loads
+        # every block before the query starts
+        self.pipeline_depth = pipeline_depth
+
         self.scheduler = scheduler
         self.history = history
         self.access_logger = access_logger
         self.block_cache = block_cache
+        self.prefetcher = prefetcher
+        # blocks read from Parquet on a cache miss are put into block_cache,
+        # otherwise only the prefetcher fills it
+        self.cache_on_read = cache_on_read
+        # (table, row group, group by, where) -> per block partial aggregates
+        self.partial_cache = partial_cache
 
-        self.pf = pq.ParquetFile(parquet_path)
-        self.num_row_groups = self.pf.num_row_groups
+        # table_name -> {"parquet_path", "pf", "num_row_groups", "columns"}
+        self.tables: Dict[str, dict] = {}
+        self.mb_index = MicroBlockIndex()
+        self.con = duckdb.connect()
+        # queries run on cursors of this pool, self.con only holds the views
+        self.cursors = CursorPool(self.con, pool_size)
+        # per thread Parquet handles, see _parquet_file
+        self._local = threading.local()
 
-        self.mb_index = MicroBlockIndex().build_from_parquet(
-            parquet_path, table_id=table_name
-        )
+        # tree.sql() of the parsed query -> result column names of queries
+        # answered from stats or partials
+        self._result_columns: Dict[str, List[str]] = {}
+
+        self.register_table(table_name, parquet_path)
+
+        self.pf = self.tables[table_name]["pf"]
+        self.num_row_groups = self.tables[table_name]["num_row_groups"]
+        # the scheduler predicts blocks of this table, none past its end
+        if getattr(scheduler, "num_blocks", 0) is None:
+            scheduler.num_blocks = self.num_row_groups
+
+        # cost aware cache policies read the usage counters of this index
+        for cache in (block_cache, partial_cache):
+            bind = getattr(getattr(cache, "policy", None), "bind", None)
+            if bind is not None:
+                bind(self.mb_index, table_name)
+
+    def register_table(self, table_name: str, parquet_path: str):
+        """
+        Register a microblock Parquet file under table_name.
+
+        Builds its MicroBlockIndex entries and a plain DuckDB view over the
+        file, which is used as fallback when a query cannot be parsed.
+        """
+        pf = pq.ParquetFile(parquet_path)
+        self.tables[table_name] = {
+            "parquet_path": parquet_path,
+            "pf": pf,
+            "num_row_groups": pf.num_row_groups,
+            "columns": set(pf.schema_arrow.names),
+            # columns whose min max stats are exact enough to answer aggregates
+            "exact_columns": {
+                field.name
+                for field in pf.schema_arrow
+                if pa.types.is_integer(field.type)
+                or pa.types.is_string(field.type)
+                or pa.types.is_large_string(field.type)
+                or pa.types.is_date(field.type)
+            },
+        }
+
+        self.mb_index.build_from_parquet(parquet_path, table_id=table_name)
 
-        self.con = duckdb.connect()
         self.con.execute(f"""
             create or replace view {table_name} as
             select * from read_parquet('{parquet_path}')
         """)
+        return self
 
     # ------------------------------------------------------------
     # pruning using MicroBlockIndex stats and sqlglot
     # ------------------------------------------------------------
 
-    def _estimate_row_groups(self, sql: str) -> List[int]:
+    def _plan_row_groups(self, tree, cursor: PooledCursor, loaded: Optional[dict] = None) -> Dict[str, List[int]]:
         """
-        Use MicroBlockIndex plus min max stats to prune row groups.
+        Use MicroBlockIndex plus min max stats to prune the row groups of
+        every registered table referenced by the query.
 
         Steps:
-          - parse SQL with sqlglot
-          - extract WHERE expression
-          - for each row group, get stats_for_row_group
-          - call _expr_may_match to see if the group can satisfy predicate
+          - collect table references and resolve their aliases per select
+          - split WHERE and inner join ON conditions into conjuncts
+          - give each conjunct to the table instance it only refers to
+          - prune each instance with _expr_may_match on its conjuncts
+          - narrow the larger side of inner equi-joins with the join key
+            min max of the smaller side
+          - run small build sides and prune the probe side with their
+            distinct join keys, keeping the loaded blocks in loaded
+          - union the instances of a table (self joins)
+        """
+        # instance key (id of select, alias) -> table name
+        instances: Dict[Tuple[int, str], str] = {}
+        # instance key -> conjuncts that only refer to that instance
+        predicates: Dict[Tuple[int, str], list] = {}
+        # ((instance, column), (instance, column)) from inner equi-joins
+        join_keys: List[Tuple[Tuple[Tuple[int, str], str], Tuple[Tuple[int, str], str]]] = []
+        # tables referenced somewhere we do not analyse, scan all
+        unscoped = set()
+
+        selects = {}
+        for table in tree.find_all(exp.Table):
+            if table.name not in self.tables:
+                continue
+            parent = table.parent
+            select = parent.parent if isinstance(parent, (exp.From, exp.Join)) else None
+            if not isinstance(select, exp.Select):
+                unscoped.add(table.name)
+                continue
+            selects[id(select)] = select
+
+        for select in selects.values():
+            self._collect_select_predicates(
+                select, instances, predicates, join_keys
+            )
+
+        candidates: Dict[Tuple[int, str], List[int]] = {}
+        for key, table_name in instances.items():
+            conjuncts = predicates.get(key, [])
+            candidates[key] = [
+                rg
+                for rg in range(self.tables[table_name]["num_row_groups"])
+                if all(
+                    self._expr_may_match(
+                        c, self.mb_index.stats_for_row_group(table_name, rg)
+                    )
+                    for c in conjuncts
+                )
+            ]
+
+        self._push_join_key_ranges(instances, candidates, join_keys)
+        if self.dynamic_filter_max_rows and join_keys:
+            if self._apply_dynamic_filters(
+                instances, predicates, candidates, join_keys,
+                loaded if loaded is not None else {}, cursor,
+            ):
+                self._push_join_key_ranges(instances, candidates, join_keys)
+
+        plan: Dict[str, set] = {}
+        for key, table_name in instances.items():
+            plan.setdefault(table_name, set()).update(candidates[key])
+        for table_name in unscoped:
+            plan[table_name] = set(range(self.tables[table_name]["num_row_groups"]))
+
+        return {name: sorted(rgs) for name, rgs in plan.items()}
+
+    def _collect_select_predicates(self, select, instances, predicates, join_keys):
+        """
+        Resolve the sources of one select and sort its conjuncts into
+        single table predicates and equi-join key pairs.
+        """
+        sid = id(select)
+
+        # alias -> table name, None for sources we have no stats for
+        aliases: Dict[str, Optional[str]] = {}
+        inner_conditions = []
+
+        from_ = select.args.get("from_") or select.args.get("from")
+        sources = [from_.this] if from_ is not None else []
+        for join in select.args.get("joins") or []:
+            sources.append(join.this)
+            on = join.args.get("on")
+            is_inner = not join.side and join.kind in ("", "INNER", "CROSS")
+            if on is not None and is_inner:
+                inner_conditions.append(on)
+
+        for source in sources:
+            if isinstance(source, exp.Table) and source.name in self.tables:
+                aliases[source.alias_or_name] = source.name
+                instances[(sid, source.alias_or_name)] = source.name
+            else:
+                aliases[source.alias_or_name] = None
+
+        where = select.args.get("where")
+        conditions = inner_conditions + ([where.this] if where is not None else [])
+
+        for condition in conditions:
+            for conjunct in self._split_conjuncts(condition):
+                if conjunct.find(exp.Select) is not None:
+                    # subquery columns belong to another scope
+                    continue
+
+                if (
+                    isinstance(conjunct, exp.EQ)
+                    and isinstance(conjunct.left, exp.Column)
+                    and isinstance(conjunct.right, exp.Column)
+                ):
+                    left = self._resolve_column(conjunct.left, aliases)
+                    right = self._resolve_column(conjunct.right, aliases)
+                    if left is not None and right is not None and left != right:
+                        join_keys.append((
+                            ((sid, left), conjunct.left.name),
+                            ((sid, right), conjunct.right.name),
+                        ))
+                        continue
+
+                owners = {
+                    self._resolve_column(col, aliases)
+                    for col in conjunct.find_all(exp.Column)
+                }
+                if len(owners) == 1 and None not in owners:
+                    predicates.setdefault((sid, owners.pop()), []).append(conjunct)
+
+    def _resolve_column(self, column, aliases) -> Optional[str]:
+        """
+        Return the alias of the registered table this column belongs to,
+        or None if it is ambiguous or not from a registered table.
+        """
+        if column.table:
+            if aliases.get(column.table) is None:
+                return None
+            return column.table
+
+        if any(table_name is None for table_name in aliases.values()):
+            # unknown sources could own any unqualified column
+            return None
+
+        owners = [
+            alias
+            for alias, table_name in aliases.items()
+            if column.name in self.tables[table_name]["columns"]
+        ]
+        if len(owners) != 1:
+            return None
+        return owners[0]
+
+    def _split_conjuncts(self, node) -> list:
+        if isinstance(node, exp.And):
+            return self._split_conjuncts(node.left) + self._split_conjuncts(node.right)
+        if isinstance(node, exp.Paren):
+            return self._split_conjuncts(node.this)
+        return [node]
+
+    def _push_join_key_ranges(self, instances, candidates, join_keys):
+        """
+        Sideways information passing on min max stats.
+
+        For every inner equi-join the side with fewer candidate rows gives
+        the min and max of its join key over its remaining blocks, and the
+        other side drops blocks whose key range cannot overlap it. Repeats
+        until nothing changes so ranges can flow along a chain of joins.
+        """
+        changed = True
+        while changed:
+            changed = False
+            for (left, left_col), (right, right_col) in join_keys:
+                if self._candidate_rows(instances[left], candidates[left]) <= \
+                        self._candidate_rows(instances[right], candidates[right]):
+                    small, small_col, large, large_col = left, left_col, right, right_col
+                else:
+                    small, small_col, large, large_col = right, right_col, left, left_col
+
+                if not candidates[small]:
+                    # inner join with an empty side returns nothing
+                    if candidates[large]:
+                        candidates[large] = []
+                        changed = True
+                    continue
+
+                key_range = self._key_range(instances[small], candidates[small], small_col)
+                if key_range is None:
+                    continue
+                low, high = key_range
+
+                kept = []
+                for rg in candidates[large]:
+                    stats = self.mb_index.stats_for_row_group(instances[large], rg).get(large_col)
+                    try:
+                        if stats is not None and stats.get("min") is not None \
+                                and stats.get("max") is not None \
+                                and (stats["max"] < low or stats["min"] > high):
+                            continue
+                    except TypeError:
+                        # key types differ, cannot compare
+                        pass
+                    kept.append(rg)
+
+                if len(kept) < len(candidates[large]):
+                    print(
+                        f"[Engine] join key range [{low}, {high}] from {instances[small]} "
+                        f"pruned {len(candidates[large]) - len(kept)} blocks of {instances[large]}"
+                    )
+                    candidates[large] = kept
+                    changed = True
+
+    def _apply_dynamic_filters(self, instances, predicates, candidates, join_keys, loaded, cursor) -> bool:
+        """
+        Runtime dynamic filters for inner equi-joins.
+
+        The side with fewer candidate rows (the build side) is read and
+        filtered by its own conjuncts in DuckDB to get its distinct join
+        keys. Blocks of the other side (the probe side) are dropped when
+        no key falls inside their min max range, or when the parquet bloom
+        filter of the key column rules out every key.
+
+        Returns True if any probe side shrank.
+        """
+        changed = False
+        for (left, left_col), (right, right_col) in join_keys:
+            left_rows = self._candidate_rows(instances[left], candidates[left])
+            right_rows = self._candidate_rows(instances[right], candidates[right])
+            if left_rows <= right_rows:
+                build, build_col, build_rows, probe, probe_col = left, left_col, left_rows, right, right_col
+            else:
+                build, build_col, build_rows, probe, probe_col = right, right_col, right_rows, left, left_col
+
+            if build_rows > self.dynamic_filter_max_rows or not candidates[probe]:
+                continue
+
+            keys = self._build_side_keys(
+                instances[build], build[1], candidates[build],
+                predicates.get(build, []), build_col, loaded, cursor,
+            )
+            kept = self._probe_row_groups(
+                instances[probe], candidates[probe], probe_col, keys, cursor
+            )
+
+            if len(kept) < len(candidates[probe]):
+                print(
+                    f"[Engine] dynamic filter with {len(keys)} keys from {instances[build]} "
+                    f"pruned {len(candidates[probe]) - len(kept)} blocks of {instances[probe]}"
+                )
+                candidates[probe] = kept
+                changed = True
+
+        return changed
+
+    def _build_side_keys(self, table_name, alias, row_groups, conjuncts, column, loaded, cursor) -> list:
         """
+        Distinct non null values of column on the build side after its own
+        predicates. The blocks read are kept in loaded for the main query.
+        """
+        key = (table_name, tuple(row_groups))
+        if key not in loaded:
+            loaded[key] = self._load_blocks(table_name, row_groups)
+
+        build_view = cursor.view_name("microblock_build")
+        build_sql = (
+            exp.select(exp.column(column, table=alias))
+            .distinct()
+            .from_(exp.to_table(build_view).as_(alias))
+        )
+        if conjuncts:
+            build_sql = build_sql.where(exp.and_(*[c.copy() for c in conjuncts]))
+
+        cursor.con.register(build_view, loaded[key])
         try:
-            tree = sqlglot.parse_one(sql)
-        except Exception:
-            # cannot parse, scan all
-            return list(range(self.num_row_groups))
+            rows = cursor.con.execute(build_sql.sql(dialect="duckdb")).fetchall()
+        finally:
+            cursor.con.unregister(build_view)
 
-        where = tree.find(exp.Where)
-        if where is None:
-            # no filter, scan all
-            return list(range(self.num_row_groups))
+        # null keys never satisfy an equi-join
+        return [r[0] for r in rows if r[0] is not None]
 
-        condition = where.this
+    def _probe_row_groups(self, table_name, row_groups, column, keys, cursor) -> List[int]:
+        """
+        Keep the probe side row groups that may contain one of keys.
+        """
+        if not keys:
+            return []
+
+        try:
+            keys = sorted(keys)
+        except TypeError:
+            return row_groups
+
+        kept = []
+        for rg in row_groups:
+            stats = self.mb_index.stats_for_row_group(table_name, rg).get(column)
+            if stats is None or stats.get("min") is None or stats.get("max") is None:
+                kept.append(rg)
+                continue
+            try:
+                # first key not below the block min must not exceed the block max
+                pos = bisect.bisect_left(keys, stats["min"])
+                if pos < len(keys) and keys[pos] <= stats["max"]:
+                    kept.append(rg)
+            except TypeError:
+                kept.append(rg)
+
+        if (
+            kept
+            and len(keys) <= self.bloom_probe_max_values
+            and self.mb_index.has_bloom_filter(table_name, column)
+        ):
+            kept = self._bloom_probe(table_name, kept, column, keys, cursor)
+
+        return kept
+
+    def _bloom_probe(self, table_name, row_groups, column, keys, cursor) -> List[int]:
+        """
+        Drop row groups whose parquet bloom filter excludes every key.
+        """
+        parquet_path = self.tables[table_name]["parquet_path"]
+        may_contain = set()
+        try:
+            for k in keys:
+                rows = cursor.con.execute(
+                    "select row_group_id from parquet_bloom_probe(?, ?, ?) "
+                    "where not bloom_filter_excludes",
+                    [parquet_path, column, k],
+                ).fetchall()
+                may_contain.update(r[0] for r in rows)
+        except Exception as e:
+            print(f"[Engine] bloom filter probe failed on {table_name}.{column}: {e}")
+            return row_groups
 
-        candidate_groups: List[int] = []
-        for rg in range(self.num_row_groups):
-            stats_by_col = self.mb_index.stats_for_row_group(self.table_name, rg)
-            if self._expr_may_match(condition, stats_by_col):
-                candidate_groups.append(rg)
+        return [rg for rg in row_groups if rg in may_contain]
 
-        if not candidate_groups:
-            # always keep at least something to avoid weird corner cases
-            return list(range(self.num_row_groups))
+    def _candidate_rows(self, table_name: str, row_groups: List[int]) -> int:
+        return sum(self.mb_index.row_count_for_row_group(table_name, rg) for rg in row_groups)
 
-        return candidate_groups
+    def _key_range(self, table_name: str, row_groups: List[int], column: str):
+        """
+        Min and max of a column over the given row groups, None if unknown.
+        """
+        low = None
+        high = None
+        for rg in row_groups:
+            stats = self.mb_index.stats_for_row_group(table_name, rg).get(column)
+            if stats is None or stats.get("min") is None or stats.get("max") is None:
+                return None
+            try:
+                low = stats["min"] if low is None else min(low, stats["min"])
+                high = stats["max"] if high is None else max(high, stats["max"])
+            except TypeError:
+                return None
+        return low, high
 
     def _expr_may_match(self, node, stats_by_col) -> bool:
         """
@@ -104,6 +576,10 @@ class StorageEngineV5:
         Uses only column level min max, so this is conservative.
         """
 
+        # parentheses
+        if isinstance(node, exp.Paren):
+            return self._expr_may_match(node.this, stats_by_col)
+
         # and
         if isinstance(node, exp.And):
             return (
@@ -165,22 +641,10 @@ class StorageEngineV5:
 
         # simple comparisons
         if isinstance(node, (exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE)):
-            left_col = self._column_name(node.left)
-            right_col = self._column_name(node.right)
-            left_val = self._literal_value(node.left)
-            right_val = self._literal_value(node.right)
-
-            col = None
-            const = None
-
-            if left_col is not None and right_val is not None:
-                col = left_col
-                const = right_val
-            elif right_col is not None and left_val is not None:
-                col = right_col
-                const = left_val
-            else:
+            comparison = self._comparison(node)
+            if comparison is None:
                 return True
+            col, op, const = comparison
 
             stats = stats_by_col.get(col)
             if stats is None:
@@ -190,30 +654,131 @@ class StorageEngineV5:
             if block_min is None or block_max is None:
                 return True
 
-            if isinstance(node, exp.EQ):
+            if op is exp.EQ:
                 return block_min <= const <= block_max
 
-            if isinstance(node, exp.NEQ):
+            if op is exp.NEQ:
                 # cannot rule out with min max easily
                 return True
 
-            if isinstance(node, exp.GT):
+            if op is exp.GT:
                 # col > const
                 return block_max > const
 
-            if isinstance(node, exp.GTE):
+            if op is exp.GTE:
                 return block_max >= const
 
-            if isinstance(node, exp.LT):
+            if op is exp.LT:
                 # col < const
                 return block_min < const
 
-            if isinstance(node, exp.LTE):
+            if op is exp.LTE:
                 return block_min <= const
 
         # unknown node types, be conservative
         return True
 
+    def _expr_must_match(self, node, stats_by_col) -> bool:
+        """
+        Return True only if every row of this row group satisfies predicate.
+        Return False if some row might not, or we cannot be sure.
+
+        stats_by_col must only hold columns whose min max are exact for
+        comparisons (see _exact_stats). A column with nulls never fully
+        matches, since null fails every comparison.
+        """
+
+        # parentheses
+        if isinstance(node, exp.Paren):
+            return self._expr_must_match(node.this, stats_by_col)
+
+        # and
+        if isinstance(node, exp.And):
+            return (
+                self._expr_must_match(node.left, stats_by_col)
+                and self._expr_must_match(node.right, stats_by_col)
+            )
+
+        # or
+        if isinstance(node, exp.Or):
+            return (
+                self._expr_must_match(node.left, stats_by_col)
+                or self._expr_must_match(node.right, stats_by_col)
+            )
+
+        # between
+        if isinstance(node, exp.Between):
+            bounds = self._non_null_bounds(stats_by_col, self._column_name(node.this))
+            low = self._literal_value(node.args.get("low"))
+            high = self._literal_value(node.args.get("high"))
+            if bounds is None or low is None or high is None:
+                return False
+            block_min, block_max = bounds
+            return low <= block_min and block_max <= high
+
+        # in operator, only a constant block can be covered
+        if isinstance(node, exp.In):
+            bounds = self._non_null_bounds(stats_by_col, self._column_name(node.this))
+            if bounds is None or bounds[0] != bounds[1]:
+                return False
+            values = [self._literal_value(e) for e in node.expressions]
+            return any(v is not None and v == bounds[0] for v in values)
+
+        # simple comparisons
+        if isinstance(node, (exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE)):
+            comparison = self._comparison(node)
+            if comparison is None:
+                return False
+            col, op, const = comparison
+
+            bounds = self._non_null_bounds(stats_by_col, col)
+            if bounds is None:
+                return False
+            block_min, block_max = bounds
+
+            if op is exp.EQ:
+                return block_min == const == block_max
+            if op is exp.NEQ:
+                return const < block_min or const > block_max
+            if op is exp.GT:
+                return block_min > const
+            if op is exp.GTE:
+                return block_min >= const
+            if op is exp.LT:
+                return block_max < const
+            if op is exp.LTE:
+                return block_max <= const
+
+        # unknown node types, cannot prove anything
+        return False
+
+    def _non_null_bounds(self, stats_by_col, col):
+        """
+        (min, max) of a column in a row group without nulls, else None.
+        """
+        stats = stats_by_col.get(col)
+        if stats is None or stats.get("null_count") != 0:
+            return None
+        if stats.get("min") is None or stats.get("max") is None:
+            return None
+        return stats["min"], stats["max"]
+
+    def _comparison(self, node):
+        """
+        Split col <op> const or const <op> col into (col, op, const), with
+        op flipped in the second form so it always reads col <op> const.
+        """
+        left_col = self._column_name(node.left)
+        right_col = self._column_name(node.right)
+        left_val = self._literal_value(node.left)
+        right_val = self._literal_value(node.right)
+
+        if left_col is not None and right_val is not None:
+            return left_col, type(node), right_val
+        if right_col is not None and left_val is not None:
+            return right_col, _FLIPPED_COMPARISONS[type(node)], left_val
+        return None
+
     def _column_name(self, node):
         if isinstance(node, exp.Column):
             return node.name
@@ -229,6 +794,696 @@ class StorageEngineV5:
             return node.this
         return None
 
+    # ------------------------------------------------------------
+    # metadata only aggregates
+    # ------------------------------------------------------------
+    def _stats_aggregate_shape(self, tree):
+        """
+        Match select <count/min/max, ...> from <table> [where ...].
+
+        Returns (table_name, aggs) where aggs is a list of
+        ("count_star" | "count" | "min" | "max", column or None) in select
+        order, or None if the query has any other shape.
+        """
+        if not isinstance(tree, exp.Select):
+            return None
+        for arg in ("joins", "group", "having", "distinct", "order", "limit", "offset"):
+            if tree.args.get(arg):
+                return None
+        if len(list(tree.find_all(exp.Select))) != 1 or tree.find(exp.With) is not None:
+            return None
+
+        from_ = tree.args.get("from_") or tree.args.get("from")
+        table = from_.this if from_ is not None else None
+        if not isinstance(table, exp.Table) or table.name not in self.tables or table.db:
+            return None
+        table_name = table.name
+        columns = self.tables[table_name]["columns"]
+
+        for col in tree.find_all(exp.Column):
+            if col.table not in ("", table.alias_or_name) or col.name not in columns:
+                return None
+
+        aggs = []
+        for projection in tree.expressions:
+            node = projection.this if isinstance(projection, exp.Alias) else projection
+            arg = node.this if isinstance(node, (exp.Count, exp.Min, exp.Max)) else None
+
+            if isinstance(node, exp.Count) and (
+                isinstance(arg, exp.Star)
+                or (isinstance(arg, exp.Literal) and self._literal_value(arg) is not None)
+            ):
+                aggs.append(("count_star", None))
+            elif isinstance(node, exp.Count) and isinstance(arg, exp.Column):
+                aggs.append(("count", arg.name))
+            elif isinstance(node, exp.Min) and isinstance(arg, exp.Column):
+                aggs.append(("min", arg.name))
+            elif isinstance(node, exp.Max) and isinstance(arg, exp.Column):
+                aggs.append(("max", arg.name))
+            else:
+                return None
+
+        return table_name, aggs
+
+    def _exact_stats(self, table_name: str, rg: int) -> dict:
+        """
+        Stats of the columns whose min max can be trusted for exact
+        answers. Float stats skip NaN, so float columns are left out.
+        """
+        exact = self.tables[table_name]["exact_columns"]
+        return {
+            col: stats
+            for col, stats in self.mb_index.stats_for_row_group(table_name, rg).items()
+            if col in exact
+        }
+
+    def _block_partials(self, table_name: str, rg: int, aggs) -> Optional[list]:
+        """
+        Per aggregate values for one row group from its stats alone, None
+        if any aggregate cannot be answered without reading the block.
+        """
+        rows = self.mb_index.row_count_for_row_group(table_name, rg)
+        stats_by_col = self._exact_stats(table_name, rg)
+        all_stats = self.mb_index.stats_for_row_group(table_name, rg)
+
+        partials = []
+        for func, col in aggs:
+            if func == "count_star":
+                partials.append(rows)
+                continue
+
+            stats = all_stats.get(col) if func == "count" else stats_by_col.get(col)
+            if stats is None or stats.get("null_count") is None:
+                return None
+
+            if func == "count":
+                partials.append(rows - stats["null_count"])
+            elif stats["null_count"] == rows:
+                # all null, no contribution
+                partials.append(None)
+            elif stats.get(func) is None:
+                return None
+            else:
+                partials.append(stats[func])
+
+        return partials
+
+    def _split_stats_aggregate(self, tree, plan):
+        """
+        Split the candidate blocks of a count/min/max query into blocks
+        fully covered by the predicate, which are answered from stats, and
+        boundary blocks that still have to be read.
+
+        Returns (aggs, partials, boundary plan) or None if the query does
+        not qualify.
+        """
+        shape = self._stats_aggregate_shape(tree)
+        if shape is None:
+            return None
+        table_name, aggs = shape
+
+        where = tree.args.get("where")
+        conjuncts = self._split_conjuncts(where.this) if where is not None else []
+
+        # a count over no rows is 0, min and max are NULL
+        partials = [0 if func in ("count_star", "count") else None for func, _ in aggs]
+        boundary = []
+        for rg in plan.get(table_name, []):
+            stats_by_col = self._exact_stats(table_name, rg)
+            block = None
+            if all(self._expr_must_match(c, stats_by_col) for c in conjuncts):
+                block = self._block_partials(table_name, rg, aggs)
+            if block is None:
+                boundary.append(rg)
+                continue
+            partials = [
+                self._merge_partial(func, acc, value)
+                for (func, _), acc, value in zip(aggs, partials, block)
+            ]
+
+        covered = len(plan.get(table_name, [])) - len(boundary)
+        print(
+            f"[Engine] answered {covered} blocks of {table_name} from stats, "
+            f"reading {len(boundary)} boundary blocks"
+        )
+        return aggs, partials, {table_name: boundary}
+
+    def _merge_partial(self, func, acc, value):
+        if value is None or (not isinstance(value, (list, tuple)) and pd.isna(value)):
+            return acc
+        if acc is None:
+            return value
+        if func in ("count_star", "count"):
+            return acc + value
+        if func == "min":
+            return min(acc, value)
+        return max(acc, value)
+
+    def _merge_stats_aggregate(self, columns, row, aggs, partials):
+        """
+        Fold the stats partials into the one row DuckDB returned for the
+        boundary blocks.
+        """
+        values = [
+            self._merge_partial(func, partial, value)
+            for (func, _), partial, value in zip(aggs, partials, row)
+        ]
+        return pd.DataFrame([values], columns=columns)
+
+    # ------------------------------------------------------------
+    # per block partial aggregates for group by
+    # ------------------------------------------------------------
+    def _partial_name(self, func: str, col: Optional[str]) -> str:
+        return f"{func}({col or ''})"
+
+    def _partial_aggregate_shape(self, tree, require_group: bool = True):
+        """
+        Match select <group keys, sum/count/min/max/avg, ...> from <table>
+        [where ...] group by <columns> [having ...] [order by ...] [limit].
+
+        Returns (table_name, alias, group_cols, partials) where partials
+        lists the (func, column) partial aggregates every block must
+        provide, or None if the query has any other shape. With
+        require_group False a query without group by matches too.
+        """
+        if not isinstance(tree, exp.Select):
+            return None
+        if require_group and not tree.args.get("group"):
+            return None
+        if tree.args.get("joins") or tree.args.get("distinct"):
+            return None
+        if len(list(tree.find_all(exp.Select))) != 1 or tree.find(exp.With) is not None:
+            return None
+        if tree.find(exp.Window) is not None:
+            return None
+
+        from_ = tree.args.get("from_") or tree.args.get("from")
+        table = from_.this if from_ is not None else None
+        if not isinstance(table, exp.Table) or table.name not in self.tables or table.db:
+            return None
+        table_name = table.name
+        alias = table.alias_or_name
+        columns = self.tables[table_name]["columns"]
+
+        group = tree.args.get("group")
+        group_cols = []
+        for key in group.expressions if group else []:
+            if not isinstance(key, exp.Column) or key.name not in columns:
+                return None
+            group_cols.append(key.name)
+
+        partials = []
+        for agg in tree.find_all(exp.AggFunc):
+            arg = agg.this
+            if isinstance(agg, exp.Count) and (
+                isinstance(arg, exp.Star)
+                or (isinstance(arg, exp.Literal) and self._literal_value(arg) is not None)
+            ):
+                needed = [("count_star", None)]
+            elif not isinstance(arg, exp.Column) or arg.name not in columns:
+                return None
+            elif isinstance(agg, exp.Count):
+                needed = [("count", arg.name)]
+            elif isinstance(agg, exp.Sum):
+                needed = [("sum", arg.name)]
+            elif isinstance(agg, exp.Min):
+                needed = [("min", arg.name)]
+            elif isinstance(agg, exp.Max):
+                needed = [("max", arg.name)]
+            elif isinstance(agg, exp.Avg):
+                needed = [("sum", arg.name), ("count", arg.name)]
+            else:
+                return None
+            for p in needed:
+                if p not in partials:
+                    partials.append(p)
+
+        aliases = {p.alias for p in tree.expressions if isinstance(p, exp.Alias)}
+        for col in tree.find_all(exp.Column):
+            if not col.table and col.name in aliases and col.name not in columns:
+                # order by or having on a select alias
+                continue
+            if col.table not in ("", alias) or col.name not in columns:
+                return None
+            # outside aggregates only group keys survive the merge
+            if col.find_ancestor(exp.AggFunc) is None and col.name not in group_cols:
+                if col.find_ancestor(exp.Where) is None:
+                    return None
+
+        return table_name, alias, group_cols, partials
+
+    def _split_partial_aggregate(self, tree, plan) -> Optional[dict]:
+        """
+        Sort the candidate blocks of a group by query into blocks whose
+        partial aggregates are cached and blocks that must be read.
+        """
+        shape = self._partial_aggregate_shape(tree)
+        if shape is None:
+            return None
+        table_name, alias, group_cols, partials = shape
+
+        where = tree.args.get("where")
+        where_sql = where.this.sql(dialect="duckdb") if where is not None else ""
+        conjuncts = self._split_conjuncts(where.this) if where is not None else []
+        needed = {self._partial_name(f, c) for f, c in partials}
+
+        cached = {}
+        missing = []
+        # partials other queries cached for the blocks being recomputed,
+        # computed for every missing block so the rewritten entries keep them
+        extra = []
+        # row group -> where text its partials depend on, "" when the
+        # predicate covers the whole block so any window can reuse them
+        block_where = {}
+        for rg in plan.get(table_name, []):
+            stats_by_col = self._exact_stats(table_name, rg)
+            if all(self._expr_must_match(c, stats_by_col) for c in conjuncts):
+                block_where[rg] = ""
+            else:
+                block_where[rg] = where_sql
+
+            key = (table_name, rg, tuple(group_cols), block_where[rg])
+            entry = self.partial_cache.get(key)
+            if entry is not None and needed <= set(entry.column_names):
+                cached[rg] = entry
+                continue
+            if entry is not None:
+                # recompute what this block already had alongside the new partials
+                for name in entry.column_names:
+                    func, _, col = name[:-1].partition("(")
+                    p = (func, col or None)
+                    if name not in group_cols and p not in partials and p not in extra:
+                        extra.append(p)
+            missing.append(rg)
+
+        print(
+            f"[Engine] partial aggregates of {table_name}: {len(cached)} blocks cached, "
+            f"{len(missing)} to compute"
+        )
+        return {
+            "table_name": table_name,
+            "alias": alias,
+            "group_cols": group_cols,
+            "partials": partials,
+            "extra_partials": extra,
+            "where_sql": where_sql,
+            "block_where": block_where,
+            "cached": cached,
+            "missing": missing,
+        }
+
+    def _compute_block_partials(self, grouped, cursor) -> Dict[int, pa.Table]:
+        """
+        Read the missing blocks and aggregate each one on its own, in one
+        DuckDB pass grouped by row group and group keys.
+        """
+        table_name = grouped["table_name"]
+        alias = grouped["alias"]
+        missing = grouped["missing"]
+        if not missing:
+            return {}
+
+        tagged = []
+        for rg in missing:
+            block = self._load_blocks(table_name, [rg])
+            block = block.append_column(
+                "__rg", pa.array([rg] * block.num_rows, type=pa.int64())
+            )
+            covered = grouped["block_where"][rg] == ""
+            tagged.append(block.append_column(
+                "__covered", pa.array([covered] * block.num_rows, type=pa.bool_())
+            ))
+        merged = self._concat_tables(tagged)
+
+        projections = [exp.column("__rg", table=alias)]
+        projections += [exp.column(c, table=alias).as_(c) for c in grouped["group_cols"]]
+        for func, col in grouped["partials"] + grouped["extra_partials"]:
+            if func == "count_star":
+                agg = exp.Count(this=exp.Star())
+            else:
+                agg_class = {"sum": exp.Sum, "count": exp.Count, "min": exp.Min, "max": exp.Max}[func]
+                agg = agg_class(this=exp.column(col, table=alias))
+            projections.append(agg.as_(self._partial_name(func, col), quoted=True))
+
+        input_view = cursor.view_name("microblock_partial_input")
+        partial_sql = (
+            exp.select(*projections)
+            .from_(exp.to_table(input_view).as_(alias))
+            .group_by(exp.column("__rg", table=alias), *[exp.column(c, table=alias) for c in grouped["group_cols"]])
+        )
+        if grouped["where_sql"]:
+            # covered blocks skip the predicate so their partials are reusable
+            partial_sql = partial_sql.where(
+                exp.or_(
+                    exp.column("__covered", table=alias),
+                    sqlglot.parse_one(grouped["where_sql"], read="duckdb"),
+                )
+            )
+
+        cursor.con.register(input_view, merged)
+        try:
+            result = self._fetch_arrow(cursor.con.execute(partial_sql.sql(dialect="duckdb")))
+        finally:
+            cursor.con.unregister(input_view)
+
+        block_ids = result["__rg"].to_pylist()
+        result = result.drop(["__rg"])
+        rows_by_rg: Dict[int, List[int]] = {}
+        for i, rg in enumerate(block_ids):
+            rows_by_rg.setdefault(rg, []).append(i)
+
+        computed = {}
+        for rg in missing:
+            # blocks with no matching rows still get an (empty) entry
+            computed[rg] = result.take(pa.array(rows_by_rg.get(rg, []), type=pa.int64()))
+            key = (table_name, rg, tuple(grouped["group_cols"]), grouped["block_where"][rg])
+            if self.partial_cache is not None:
+                self.partial_cache.put(key, computed[rg])
+        return computed
+
+    def _merge_expression(self, agg):
+        """
+        Expression over the partials table that merges one aggregate.
+        """
+        arg = agg.this
+        if isinstance(agg, exp.Count) and not isinstance(arg, exp.Column):
+            partial = exp.column(self._partial_name("count_star", None), quoted=True)
+            return exp.cast(exp.Sum(this=partial), "BIGINT")
+
+        name = arg.name
+        if isinstance(agg, exp.Count):
+            partial = exp.column(self._partial_name("count", name), quoted=True)
+            return exp.cast(exp.Sum(this=partial), "BIGINT")
+        if isinstance(agg, exp.Sum):
+            return exp.Sum(this=exp.column(self._partial_name("sum", name), quoted=True))
+        if isinstance(agg, exp.Min):
+            return exp.Min(this=exp.column(self._partial_name("min", name), quoted=True))
+        if isinstance(agg, exp.Max):
+            return exp.Max(this=exp.column(self._partial_name("max", name), quoted=True))
+        # avg
+        total = exp.Sum(this=exp.column(self._partial_name("sum", name), quoted=True))
+        count = exp.Sum(this=exp.column(self._partial_name("count", name), quoted=True))
+        return exp.Div(this=total, expression=count)
+
+    def _run_partial_aggregate(self, tree, grouped, cursor):
+        """
+        Merge cached and freshly computed block partials with the original
+        select list, having, order and limit applied on top.
+        """
+        computed = self._compute_block_partials(grouped, cursor)
+        blocks = list(grouped["cached"].values()) + list(computed.values())
+
+        needed = [self._partial_name(f, c) for f, c in grouped["partials"]]
+        columns = grouped["group_cols"] + [n for n in needed if n not in grouped["group_cols"]]
+        if blocks:
+            partials = self._concat_tables([b.select(columns) for b in blocks])
+        else:
+            partials = None
+
+        partials_view = cursor.view_name("microblock_partials")
+
+        def transform(node):
+            if isinstance(node, exp.AggFunc):
+                return self._merge_expression(node)
+            if isinstance(node, exp.Table) and node.name == grouped["table_name"]:
+                return exp.to_table(partials_view).as_(grouped["alias"])
+            return node
+
+        if partials is None:
+            # nothing matched, the original query on no rows is the answer
+            return self._run_on_empty(tree, grouped["table_name"], cursor)
+
+        # result names of the original query, which the merge would lose
+        columns = self._query_result_columns(tree, grouped["table_name"], cursor)
+
+        merge_tree = tree.copy()
+        merge_tree.set("where", None)
+        merge_sql = merge_tree.transform(transform).sql(dialect="duckdb")
+        print(f"[Engine] merging partials with: {merge_sql}")
+
+        cursor.con.register(partials_view, partials)
+        try:
+            result = cursor.con.execute(merge_sql).df()
+        finally:
+            cursor.con.unregister(partials_view)
+        result.columns = columns
+        return result
+
+    def _run_on_empty(self, tree, table_name: str, cursor) -> pd.DataFrame:
+        """
+        Run the query against an empty table with the file schema.
+        """
+        view_name = self._data_view_name(table_name, cursor)
+        cursor.con.register(view_name, self.tables[table_name]["pf"].schema_arrow.empty_table())
+        try:
+            empty = cursor.con.execute(self._rewrite_tables(tree, cursor)).df()
+        finally:
+            cursor.con.unregister(view_name)
+        self._remember_columns(tree.sql(dialect="duckdb"), list(empty.columns))
+        return empty
+
+    def _query_result_columns(self, tree, table_name: str, cursor) -> List[str]:
+        """
+        Column names DuckDB gives the result of this query.
+        """
+        columns = self._result_columns.get(tree.sql(dialect="duckdb"))
+        if columns is None:
+            columns = list(self._run_on_empty(tree, table_name, cursor).columns)
+        return columns
+
+    def _remember_columns(self, sql: str, columns: List[str]):
+        if len(self._result_columns) >= 256:
+            self._result_columns.clear()
+        self._result_columns[sql] = columns
+
+    # ------------------------------------------------------------
+    # approximate queries with block sampling
+    # ------------------------------------------------------------
+    def _sample_blocks(self, table_name: str, row_groups: List[int], fraction: float, rng):
+        """
+        Stratified random sample of candidate row groups.
+
+        Candidates are cut into contiguous strata of about equal row count
+        (from MicroBlockIndex), and each stratum gets a share of the sample
+        proportional to its rows, at least two blocks so its variance can
+        be estimated. Returns (sampled row groups, rg -> stratum,
+        stratum -> (blocks in stratum, blocks sampled)).
+        """
+        weights = [self.mb_index.row_count_for_row_group(table_name, rg) for rg in row_groups]
+        total = sum(weights)
+        target = min(len(row_groups), max(2, math.ceil(fraction * len(row_groups))))
+
+        num_strata = max(1, target // 2)
+        strata: List[List[int]] = [[] for _ in range(num_strata)]
+        seen = 0
+        for rg, w in zip(row_groups, weights):
+            strata[min(num_strata - 1, int(seen * num_strata / max(total, 1)))].append(rg)
+            seen += w
+
+        sampled = []
+        stratum_of = {}
+        sizes = {}
+        for h, blocks in enumerate(b for b in strata if b):
+            rows = sum(self.mb_index.row_count_for_row_group(table_name, rg) for rg in blocks)
+            n_h = min(len(blocks), max(2, round(target * rows / max(total, 1))))
+            chosen = sorted(rng.sample(blocks, n_h))
+            sampled.extend(chosen)
+            for rg in chosen:
+                stratum_of[rg] = h
+            sizes[h] = (len(blocks), n_h)
+
+        return sampled, stratum_of, sizes
+
+    def _split_approx_aggregate(self, tree, plan, fraction: float, seed) -> Optional[dict]:
+        """
+        Pick the sampled blocks for an approximate aggregate query, or None
+        if the query cannot be estimated and should run exactly.
+
+        Supported: select <group keys, count/sum/avg/min/max> from <table>
+        [where ...] [group by <columns>], without having, order or limit
+        since those would act on estimates.
+        """
+        shape = self._partial_aggregate_shape(tree, require_group=False)
+        if shape is None:
+            return None
+        for arg in ("having", "order", "limit", "offset"):
+            if tree.args.get(arg):
+                return None
+        table_name, alias, group_cols, partials = shape
+
+        for projection in tree.expressions:
+            node = projection.this if isinstance(projection, exp.Alias) else projection
+            if isinstance(node, exp.Column) and node.name in group_cols:
+                continue
+            if not isinstance(node, (exp.Count, exp.Sum, exp.Avg, exp.Min, exp.Max)):
+                return None
+
+        row_groups = plan.get(table_name, [])
+        sampled, stratum_of, sizes = self._sample_blocks(
+            table_name, row_groups, fraction, random.Random(seed)
+        )
+        if len(sampled) >= len(row_groups):
+            return None
+
+        print(
+            f"[Engine] approximate query on {len(sampled)} of {len(row_groups)} "
+            f"blocks of {table_name} in {len(sizes)} strata"
+        )
+        where = tree.args.get("where")
+        where_sql = where.this.sql(dialect="duckdb") if where is not None else ""
+        return {
+            "table_name": table_name,
+            "alias": alias,
+            "group_cols": group_cols,
+            "partials": partials,
+            "extra_partials": [],
+            "where_sql": where_sql,
+            "block_where": {rg: where_sql for rg in sampled},
+            "cached": {},
+            "missing": sampled,
+            "stratum_of": stratum_of,
+            "sizes": sizes,
+        }
+
+    def _estimate_total(self, acc, group, sizes, col, ratio=None, den=None):
+        """
+        Stratified estimate of a block level total for one group, with its
+        variance. With ratio and den it returns the variance of
+        col - ratio * den instead (linearised ratio estimator).
+
+        acc maps (group, stratum) to the sums of each partial ("s") and of
+        products of partials ("ss") over the sampled blocks. Sampled blocks
+        without a row for the group count as zeros.
+        """
+        total = 0.0
+        var = 0.0
+        for h, (pop_blocks, n_blocks) in sizes.items():
+            cell = acc.get((group, h))
+            if cell is None:
+                continue
+            s1 = cell["s"][col]
+            s2 = cell["ss"][(col, col)]
+            if ratio is not None:
+                s1 = s1 - ratio * cell["s"][den]
+                s2 = s2 - 2 * ratio * cell["ss"][(col, den)] + ratio * ratio * cell["ss"][(den, den)]
+
+            total += pop_blocks / n_blocks * s1
+            if n_blocks > 1:
+                sample_var = max(0.0, (s2 - s1 * s1 / n_blocks) / (n_blocks - 1))
+                var += pop_blocks ** 2 * (1 - n_blocks / pop_blocks) * sample_var / n_blocks
+        return total, var
+
+    def _run_approx_aggregate(self, tree, approx, confidence: float, cursor) -> pd.DataFrame:
+        """
+        Scale the sampled block partials up to the whole candidate set and
+        attach <column>_ci_low and <column>_ci_high for count, sum and avg
+        at the given confidence level. min and max are sample values.
+
+        The intervals use Student's t with one degree of freedom per
+        sampled block less one per stratum, so a sample of a few blocks
+        gets the wide interval it warrants.
+        """
+        computed = self._compute_block_partials(approx, cursor)
+        group_cols = approx["group_cols"]
+        additive = [
+            self._partial_name(f, c) for f, c in approx["partials"]
+            if f in ("count_star", "count", "sum")
+        ]
+
+        groups = {}
+        acc = {}
+        extremes = {}
+        for rg, block in computed.items():
+            h = approx["stratum_of"][rg]
+            for row in block.to_pylist():
+                group = tuple(row[c] for c in group_cols)
+                groups.setdefault(group, None)
+                cell = acc.setdefault((group, h), {
+                    "s": dict.fromkeys(additive, 0.0),
+                    "ss": {(a, b): 0.0 for a in additive for b in additive},
+                })
+                values = {a: float(row[a] or 0) for a in additive}
+                for a in additive:
+                    cell["s"][a] += values[a]
+                    for b in additive:
+                        cell["ss"][(a, b)] += values[a] * values[b]
+                ext = extremes.setdefault(group, {})
+                for func, col in approx["partials"]:
+                    name = self._partial_name(func, col)
+                    if func in ("min", "max") and row[name] is not None:
+                        pick = min if func == "min" else max
+                        ext[name] = row[name] if name not in ext else pick(ext[name], row[name])
+
+        if not groups:
+            return self._run_on_empty(tree, approx["table_name"], cursor)
+
+        sizes = approx["sizes"]
+        # fully read strata add no variance and no degrees of freedom
+        df = sum(n_blocks - 1 for pop_blocks, n_blocks in sizes.values() if n_blocks < pop_blocks)
+        z = _t_quantile(confidence, df)
+        columns = self._query_result_columns(tree, approx["table_name"], cursor)
+
+        out = {}
+        bounds = {}
+        for name, projection in zip(columns, tree.expressions):
+            node = projection.this if isinstance(projection, exp.Alias) else projection
+            if isinstance(node, exp.Column):
+                i = group_cols.index(node.name)
+                out[name] = [g[i] for g in groups]
+                continue
+
+            arg = node.this
+            if isinstance(node, (exp.Min, exp.Max)):
+                partial = self._partial_name("min" if isinstance(node, exp.Min) else "max", arg.name)
+                out[name] = [extremes[g].get(partial) for g in groups]
+                continue
+
+            estimates = []
+            errors = []
+            for g in groups:
+                if isinstance(node, exp.Avg):
+                    num = self._partial_name("sum", arg.name)
+                    den = self._partial_name("count", arg.name)
+                    total, _ = self._estimate_total(acc, g, sizes, num)
+                    count, _ = self._estimate_total(acc, g, sizes, den)
+                    if not count:
+                        estimates.append(None)
+                        errors.append(None)
+                        continue
+                    ratio = total / count
+                    _, resid_var = self._estimate_total(acc, g, sizes, num, ratio=ratio, den=den)
+                    estimates.append(ratio)
+                    errors.append(resid_var ** 0.5 / count)
+                else:
+                    if isinstance(node, exp.Count) and not isinstance(arg, exp.Column):
+                        partial = self._partial_name("count_star", None)
+                    else:
+                        func = "count" if isinstance(node, exp.Count) else "sum"
+                        partial = self._partial_name(func, arg.name)
+                    total, var = self._estimate_total(acc, g, sizes, partial)
+                    estimates.append(total)
+                    errors.append(var ** 0.5)
+
+            out[name] = estimates
+            bounds[f"{name}_ci_low"] = [
+                None if e is None else e - z * se for e, se in zip(estimates, errors)
+            ]
+            bounds[f"{name}_ci_high"] = [
+                None if e is None else e + z * se for e, se in zip(estimates, errors)
+            ]
+
+        out.update(bounds)
+        return pd.DataFrame(out)
+
+    def _fetch_arrow(self, result) -> pa.Table:
+        """
+        Arrow table from a DuckDB result, newer releases hand back a reader.
+        """
+        table = result.arrow()
+        if isinstance(table, pa.RecordBatchReader):
+            table = table.read_all()
+        return table
+
     # ------------------------------------------------------------
     # concat helper
     # ------------------------------------------------------------
@@ -236,70 +1491,409 @@ class StorageEngineV5:
         if len(tables) == 1:
             return tables[0]
         return pa.concat_tables(tables, promote=True)
+
     # ------------------------------------------------------------
-    # main query with cache integration
+    # table registration and rewrite helpers
     # ------------------------------------------------------------
-    def query(self, sql: str):
-        row_groups = self._estimate_row_groups(sql)
-        print(f"[Engine] candidate row groups for this query: {row_groups}")
-        self.last_row_groups = row_groups
-
-
-        # if self.access_logger:
-        #     self.access_logger.log("GLOBAL", row_groups)
-
-        if self.access_logger:
-            self.access_logger.log(row_groups)
+    def end_session(self, session: str):
+        """
+        Forget the access history of a finished session.
+        """
+        if self.history:
+            self.history.end_session(session)
+        if self.scheduler:
+            self.scheduler.forget(session)
 
+    def _cache_key(self, table_name: str, rg: int):
+        if table_name == self.table_name:
+            return rg
+        return (table_name, rg)
 
-        if self.history:
-            for rg in row_groups:
-                self.history.record(rg)
+    def _data_view_name(self, table_name: str, cursor: PooledCursor) -> str:
+        return cursor.view_name(f"microblock_{table_name}")
 
-        if self.scheduler:
-            for rg in row_groups:
-                self.scheduler.register_access("GLOBAL", rg)
+    def _load_blocks(self, table_name: str, row_groups: List[int]) -> pa.Table:
+        """
+        Serve row groups of one table from BlockCache, read misses from
+        Parquet and merge them. Returns an empty table with the file schema
+        when nothing is left after pruning.
+        """
+        pf = self._parquet_file(table_name)
 
         cached_tables = []
         missing = []
 
-        if self.block_cache:
+        if self.block_cache is not None:
             for rg in row_groups:
-                tbl = self.block_cache.get(rg)
+                tbl = self.block_cache.get(self._cache_key(table_name, rg))
                 if tbl is not None:
-                    print(f"[Engine] cache hit on block {rg}")
+                    print(f"[Engine] cache hit on block {rg} of {table_name}")
                     cached_tables.append(tbl)
                 else:
-                    print(f"[Engine] cache miss on block {rg}")
+                    print(f"[Engine] cache miss on block {rg} of {table_name}")
                     missing.append(rg)
         else:
             missing = row_groups
 
         missing_tables = []
         for rg in missing:
-            t = self.pf.read_row_group(rg)
-            print(f"[Engine] loaded block {rg} from Parquet")
+            t = pf.read_row_group(rg)
+            print(f"[Engine] loaded block {rg} of {table_name} from Parquet")
+            if self.cache_on_read and self.block_cache is not None:
+                self.block_cache.put(self._cache_key(table_name, rg), t)
             missing_tables.append(t)
 
         all_tables = cached_tables + missing_tables
-
         if not all_tables:
-            print("[Engine] no tables to query, returning empty result via DuckDB fallback")
-            return self.con.execute(sql).df()
+            return pf.schema_arrow.empty_table()
+
+        return self._concat_tables(all_tables)
+
+    def _read_block(self, table_name: str, rg: int) -> pa.Table:
+        """
+        One row group from BlockCache, or from Parquet on a miss.
+        """
+        if self.block_cache is not None:
+            tbl = self.block_cache.get(self._cache_key(table_name, rg))
+            if tbl is not None:
+                print(f"[Engine] cache hit on block {rg} of {table_name}")
+                return tbl
+            print(f"[Engine] cache miss on block {rg} of {table_name}")
+
+        tbl = self._parquet_file(table_name).read_row_group(rg)
+        print(f"[Engine] loaded block {rg} of {table_name} from Parquet")
+        if self.cache_on_read and self.block_cache is not None:
+            self.block_cache.put(self._cache_key(table_name, rg), tbl)
+        return tbl
+
+    def _parquet_file(self, table_name: str) -> pq.ParquetFile:
+        """
+        ParquetFile of table_name for the calling thread. Queries may run
+        on several threads at once, each reads through its own handle.
+        """
+        info = self.tables[table_name]
+        if threading.current_thread() is threading.main_thread():
+            return info["pf"]
+
+        handles = getattr(self._local, "parquet_files", None)
+        if handles is None:
+            handles = self._local.parquet_files = {}
+        key = (table_name, info["parquet_path"])
+        if key not in handles:
+            handles[key] = pq.ParquetFile(info["parquet_path"])
+        return handles[key]
 
-        merged = self._concat_tables(all_tables)
+    def _rewrite_tables(self, tree, cursor: PooledCursor) -> str:
+        """
+        Point every registered table reference at its microblock view.
+        Unaliased references keep their name as alias so qualified columns
+        like mytable.column1 still resolve.
+        """
+        def transform(node):
+            if isinstance(node, exp.Table) and node.name in self.tables and not node.db:
+                alias = node.alias_or_name
+                return exp.to_table(self._data_view_name(node.name, cursor)).as_(alias)
+            return node
+
+        return tree.transform(transform).sql(dialect="duckdb")
+
+    # ------------------------------------------------------------
+    # main query with cache integration
+    # ------------------------------------------------------------
+    def query(
+        self,
+        sql: str,
+        approx: bool = False,
+        sample_fraction: float = 0.1,
+        confidence: float = 0.95,
+        seed: Optional[int] = None,
+        session: str = "GLOBAL",
+    ):
+        """
+        Run sql and return a pandas DataFrame.
+
+        With approx=True, count/sum/avg/min/max queries over one table run
+        on a stratified random sample_fraction of the candidate blocks.
+        count, sum and avg are scaled to the full candidate set, and
+        <column>_ci_low / <column>_ci_high columns hold the confidence
+        interval. Queries that cannot be estimated run exactly.
 
-        # defensive unregister
+        session names the client or query stream. Its accesses are kept
+        apart in history and scheduler, so the prefetcher predicts every
+        session from its own sequence.
+        """
+        return self._run_query(sql, "df", None, approx, sample_fraction, confidence, seed, session)
+
+    def query_arrow(
+        self,
+        sql: str,
+        approx: bool = False,
+        sample_fraction: float = 0.1,
+        confidence: float = 0.95,
+        seed: Optional[int] = None,
+        session: str = "GLOBAL",
+    ) -> pa.Table:
+        """
+        Like query, but returns an Arrow Table and skips the pandas conversion.
+        """
+        return self._run_query(sql, "arrow", None, approx, sample_fraction, confidence, seed, session)
+
+    def query_reader(
+        self,
+        sql: str,
+        batch_size: int = 100_000,
+        approx: bool = False,
+        sample_fraction: float = 0.1,
+        confidence: float = 0.95,
+        seed: Optional[int] = None,
+        session: str = "GLOBAL",
+    ) -> pa.RecordBatchReader:
+        """
+        Like query, but streams the result as a RecordBatchReader of up to
+        batch_size rows per batch, using DuckDB's fetch_record_batch.
+
+        The final query runs on its own cursor, so the stream stays valid
+        while other queries run on the engine. The cursor is closed once
+        the reader is exhausted.
+        """
+        return self._run_query(sql, "reader", batch_size, approx, sample_fraction, confidence, seed, session)
+
+    def query_batches(self, sql: str, batch_size: int = 100_000, **kwargs):
+        """
+        Iterate over the result of sql as Arrow RecordBatches.
+        """
+        return iter(self.query_reader(sql, batch_size=batch_size, **kwargs))
+
+    def _run_query(self, sql, output, batch_size, approx, sample_fraction, confidence, seed, session):
+        """
+        Shared body of query, query_arrow and query_reader. output is
+        "df", "arrow" or "reader".
+
+        The query runs on a cursor of the pool, so concurrent queries never
+        see each other's registered blocks. A streamed result keeps its
+        cursor until the last batch is read and gets one outside the pool.
+        """
+        args = (sql, output, batch_size, approx, sample_fraction, confidence, seed, session)
+        # background prefetches wait until this query has its result
+        if self.prefetcher is not None:
+            self.prefetcher.foreground_begin()
+        if output == "reader":
+            # DuckDB runs the query as batches are pulled, _release ends
+            # the foreground section with the stream
+            try:
+                cursor = self.cursors.open()
+            except Exception:
+                if self.prefetcher is not None:
+                    self.prefetcher.foreground_end()
+                raise
+            return self._execute(*args, cursor, True)
+        try:
+            with self.cursors.cursor() as cursor:
+                return self._execute(*args, cursor, False)
+        finally:
+            if self.prefetcher is not None:
+                self.prefetcher.foreground_end()
+
+    def _execute(self, sql, output, batch_size, approx, sample_fraction, confidence, seed, session, cursor, owned):
+        """
+        Run one query on cursor. owned cursors are closed when the result
+        has been delivered.
+        """
+        con = cursor.con
+        # loaders and views of this query, released with the cursor
+        pipelines = []
+        views = []
+
+        # any error before the result is delivered releases the cursor,
+        # an owned one would leak otherwise
         try:
-            tables_df = self.con.execute("pragma show_tables").fetchdf()
-            if "microblock_data" in tables_df["name"].tolist():
-                self.con.unregister("microblock_data")
+            try:
+                tree = sqlglot.parse_one(sql, read="duckdb")
+            except Exception:
+                tree = None
+
+            if tree is None:
+                # cannot parse, let DuckDB scan the registered views directly
+                print("[Engine] could not parse query, running it on the Parquet views")
+                return self._deliver(con.execute(sql), output, batch_size, cursor, owned)
+
+            # blocks already read while planning, keyed by (table, row groups)
+            loaded = {}
+            plan = self._plan_row_groups(tree, cursor, loaded)
+            for table_name, rgs in plan.items():
+                print(f"[Engine] candidate row groups of {table_name} for this query: {rgs}")
+
+            # block sampled estimate instead of an exact answer
+            sampled = None
+            if approx:
+                sampled = self._split_approx_aggregate(tree, plan, sample_fraction, seed)
+                if sampled is None:
+                    print("[Engine] query cannot be estimated from a block sample, running exactly")
+                else:
+                    plan = {sampled["table_name"]: sampled["missing"]}
+
+            # count min max answered from block stats, only boundary blocks are read
+            aggregate = None
+            if sampled is None:
+                aggregate = self._split_stats_aggregate(tree, plan)
+                if aggregate is not None:
+                    aggs, partials, plan = aggregate
+
+            # group by aggregates merged from cached per block partials
+            grouped = None
+            if sampled is None and aggregate is None and self.partial_cache is not None:
+                grouped = self._split_partial_aggregate(tree, plan)
+                if grouped is not None:
+                    plan = {grouped["table_name"]: grouped["missing"]}
+
+            self.last_plan = plan
+
+            columns = self._result_columns.get(tree.sql(dialect="duckdb"))
+            if aggregate is not None and not any(plan.values()) and columns is not None:
+                # nothing to read and the result shape is known, skip DuckDB
+                self.last_row_groups = []
+                result = self._merge_stats_aggregate(columns, [None] * len(aggs), aggs, partials)
+                return self._deliver(result, output, batch_size, cursor, owned)
+
+            row_groups = plan.get(self.table_name, [])
+            self.last_row_groups = row_groups
+
+            # usage counters of the blocks this query reads
+            for table_name, rgs in plan.items():
+                for rg in rgs:
+                    self.mb_index.mark_row_group_access(table_name, rg)
+
+
+            # if self.access_logger:
+            #     self.access_logger.log("GLOBAL", row_groups)
+
+            if self.access_logger and row_groups:
+                self.access_logger.log(row_groups, session)
+
+
+            if self.history:
+                for rg in row_groups:
+                    self.history.record(rg, session)
+
+            if self.scheduler:
+                for rg in row_groups:
+                    self.scheduler.register_access(session, rg)
+
+            # this query reads them itself, prefetching them is wasted I/O
+            if self.prefetcher is not None and row_groups:
+                self.prefetcher.cancel(row_groups)
+
+            if not plan:
+                print("[Engine] no tables to query, returning empty result via DuckDB fallback")
+                return self._deliver(con.execute(sql), output, batch_size, cursor, owned)
+
+            if sampled is not None:
+                result = self._run_approx_aggregate(tree, sampled, confidence, cursor)
+                return self._deliver(result, output, batch_size, cursor, owned)
+
+            if grouped is not None:
+                result = self._run_partial_aggregate(tree, grouped, cursor)
+                return self._deliver(result, output, batch_size, cursor, owned)
+
+            # a table scanned once can stream its blocks while DuckDB runs
+            for table_name, rgs in plan.items():
+                merged = loaded.get((table_name, tuple(rgs)))
+                view_name = self._data_view_name(table_name, cursor)
+                views.append(view_name)
+
+                if merged is None and self.pipeline_depth and self._scanned_once(tree, table_name):
+                    pipeline = BlockPipeline(
+                        rgs,
+                        lambda rg, name=table_name: self._read_block(name, rg),
+                        self.tables[table_name]["pf"].schema_arrow,
+                        depth=self.pipeline_depth,
+                    )
+                    pipelines.append(pipeline)
+                    con.register(view_name, pipeline.reader())
+                    continue
+
+                if merged is None:
+                    merged = self._load_blocks(table_name, rgs)
+                con.register(view_name, merged)
+
+            rewritten_sql = self._rewrite_tables(tree, cursor)
+            print(f"[Engine] executing rewritten sql: {rewritten_sql}")
+
+            result = con.execute(rewritten_sql)
+            if aggregate is not None:
+                result = result.df()
+                self._remember_columns(tree.sql(dialect="duckdb"), list(result.columns))
+                row = list(next(result.itertuples(index=False, name=None))) if len(result) else [None] * len(aggs)
+                result = self._merge_stats_aggregate(list(result.columns), row, aggs, partials)
+            return self._deliver(result, output, batch_size, cursor, owned, pipelines, views)
         except Exception:
-            pass
+            self._release(cursor, owned, pipelines, views)
+            raise
+
+    def _scanned_once(self, tree, table_name: str) -> bool:
+        """
+        True if the outer select reads table_name once itself. A CTE,
+        subquery or set operation may make DuckDB scan it more than once,
+        which a BlockPipeline reader cannot serve.
+        """
+        if not isinstance(tree, exp.Select) or tree.find(exp.With) is not None:
+            return False
+        scans = [t for t in tree.find_all(exp.Table) if t.name == table_name]
+        return len(scans) == 1 and scans[0].find_ancestor(exp.Select) is tree
 
-        self.con.register("microblock_data", merged)
+    def _deliver(self, result, output, batch_size, cursor, owned, pipelines=(), views=()):
+        """
+        Hand back a DuckDB result or an already built DataFrame as a
+        DataFrame ("df"), Arrow Table ("arrow") or RecordBatchReader
+        ("reader").
+        """
+        if isinstance(result, pd.DataFrame):
+            self._release(cursor, owned, pipelines, views)
+            if output == "df":
+                return result
+            table = pa.Table.from_pandas(result, preserve_index=False)
+            if output == "arrow":
+                return table
+            return table.to_reader(max_chunksize=batch_size)
 
-        rewritten_sql = sql.replace(self.table_name, "microblock_data")
-        print(f"[Engine] executing rewritten sql: {rewritten_sql}")
+        if output in ("df", "arrow"):
+            try:
+                return result.df() if output == "df" else self._fetch_arrow(result)
+            finally:
+                self._release(cursor, owned, pipelines, views)
 
-        return self.con.execute(rewritten_sql).df()
\ No newline at end of file
+        reader = result.fetch_record_batch(batch_size)
+        stream = self._stream(reader, cursor, owned, pipelines, views)
+        # started, so a reader dropped unread still releases on close
+        next(stream)
+        return pa.RecordBatchReader.from_batches(reader.schema, stream)
+
+    def _stream(self, reader, cursor, owned, pipelines=(), views=()):
+        # holds the cursor until the last batch is read
+        try:
+            yield
+            for batch in reader:
+                yield batch
+        finally:
+            self._release(cursor, owned, pipelines, views)
+
+    def _release(self, cursor, owned, pipelines=(), views=()):
+        """
+        Stop block loaders of a finished query and drop its views, so a
+        pooled cursor does not keep the blocks alive. owned cursors, those
+        of streamed results, are closed and end the query's foreground
+        section.
+        """
+        for pipeline in pipelines:
+            pipeline.close()
+        for view_name in views:
+            try:
+                cursor.con.unregister(view_name)
+            except Exception:
+                pass
+        if owned and not cursor.closed:
+            try:
+                cursor.close()
+            finally:
+                if self.prefetcher is not None:
+                    self.prefetcher.foreground_end()
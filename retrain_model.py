@@ -87,7 +87,7 @@ import json
 import torch
 import torch.nn as nn
 from torch.utils.data import TensorDataset, DataLoader
-from model import LSTMPrefetcher
+from model import LSTMPrefetcher, compiled_model_path, export_compiled_model
 
 def main():
     # Load training dataset
@@ -147,6 +147,11 @@ def main():
     
     # Save model
     torch.save(model.state_dict(), "trained_model.pt")
+
+    # int8 TorchScript copy for the scheduler, loaded instead of the weights
+    model.eval()
+    export_compiled_model(model, compiled_model_path("trained_model.pt"))
+    print(f"exported quantized TorchScript model {compiled_model_path('trained_model.pt')}")
     
     # ✅ FIX: Save vocab_size in mappings
     with open("trained_mappings.json", "w") as f:
@@ -12,7 +12,8 @@ PARQUET_PATH = "output_microblocks.parquet"
 TABLE_NAME = "mytable"
 
 # core shared components
-cache = BlockCache(capacity=64)
+# a quarter of the cache holds predictions until a query uses them
+cache = BlockCache(capacity=64, prefetch_capacity=16)
 history = GlobalHistory(maxlen=200)
 logger = AccessLogger()
 
@@ -36,8 +37,9 @@ service = PrefetchService(
     scheduler=scheduler,
     prefetcher=prefetcher,
     interval=60,
-    min_confidence=0.4,
     history_len=30,
+    # read at most 32 MB of compressed blocks per second
+    io_budget=32 << 20,
 )
 service.start()
 
@@ -5,11 +5,14 @@ from prefetch_scheduler import PrefetchScheduler
 from prefetch import Prefetcher
 from prefetch_service import PrefetchService
 from query_enginev5 import StorageEngineV5
+from online_trainer import OnlineTrainer
+from warm_cache import WarmCache
 
 PARQUET_PATH = "output_microblocks.parquet"
 TABLE_NAME = "mytable"
 
-cache = BlockCache(capacity=128)
+# a quarter of the cache holds predictions until a query uses them
+cache = BlockCache(capacity=128, prefetch_capacity=32)
 history = GlobalHistory(maxlen=500)
 logger = AccessLogger(path="access_log.json")
 
@@ -18,37 +21,53 @@ scheduler = PrefetchScheduler.from_files(
     model_path="trained_model.pt",
     mapping_path="trained_mappings.json",
     prefetch_threshold=0.4,  
-    max_history=64
+    max_history=64,
+    # stride and markov predictors compete with the LSTM per session, the
+    # LSTM is only fed when a prediction needs it, so not stateful
+    predictor=["stride", "markov2", "delta"],
 )
 
-prefetcher = Prefetcher(PARQUET_PATH, cache)
+# predicted blocks are read by 4 background workers
+prefetcher = Prefetcher(PARQUET_PATH, cache, workers=4)
 
 service = PrefetchService(
     history=history,
     scheduler=scheduler,
     prefetcher=prefetcher,
+    # predict on new accesses, at least once a minute when idle
     interval=60,  
     # min_confidence=0.3,  
-    history_len=100
+    history_len=100,
+    # read at most 64 MB of compressed blocks per second
+    io_budget=64 << 20,
 )
 
 service.start()
 
+# fine-tune the LSTM on the live accesses, swapped in when it predicts better
+trainer = OnlineTrainer(scheduler, history, model_path="trained_model.pt")
+trainer.start()
+
 engine = StorageEngineV5(
     parquet_path=PARQUET_PATH,
     table_name=TABLE_NAME,
     scheduler=scheduler,
     history=history,
     access_logger=logger,
-    block_cache=cache
+    block_cache=cache,
+    prefetcher=prefetcher
 )
 
+# refill the cache with the hot blocks of the last run while the shell starts
+warm_cache = WarmCache(engine, directory="warm_cache", priority="ewma")
+warm_cache.rehydrate()
+
 print(f"""
 === Microblock Engine Interactive Shell ===
 Type SQL queries using '{TABLE_NAME}'.
 Example: select * from {TABLE_NAME} where column1 between 18 and 24;
 Press CTRL+C to exit.
-Prefetcher is running every 60 seconds in background.
+Prefetcher runs in background whenever new blocks are accessed.
 """)
 
 try:
@@ -63,4 +82,8 @@ try:
 except (KeyboardInterrupt, EOFError):
     print("\nExiting interactive shell...")
 finally:
-    service.stop()
\ No newline at end of file
+    service.stop()
+    trainer.stop()
+    prefetcher.close()
+    warm_cache.stop()
+    warm_cache.snapshot()
\ No newline at end of file
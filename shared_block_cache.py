@@ -0,0 +1,164 @@
+# shared_block_cache.py
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import pyarrow as pa
+
+from spill_tier import key_file_name, map_arrow_file, write_arrow_file
+
+
+class SharedBlockCache:
+    """
+    Block cache shared by several processes.
+
+    Blocks are written once as uncompressed Arrow IPC files in directory
+    and read back with pa.memory_map, so every process maps the same page
+    cache pages instead of holding its own decoded copy. A small sqlite
+    index in the same directory maps keys to files, tracks their size and
+    last access, and evicts least recently used blocks once the files
+    exceed capacity_bytes.
+
+    Has the get / put / contains / remove / clear interface of BlockCache,
+    values must be Arrow tables.
+    """
+
+    def __init__(self, directory: str, capacity_bytes: int = 1 << 30):
+        self.directory = directory
+        self.capacity_bytes = capacity_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"),
+            timeout=30.0,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        with self._lock:
+            self._db.execute("pragma journal_mode=wal")
+            self._db.execute(
+                "create table if not exists blocks ("
+                " key text primary key, file text not null,"
+                " nbytes integer not null, last_access real not null)"
+            )
+
+    @property
+    def capacity(self) -> int:
+        return self.capacity_bytes
+
+    def _key(self, block_id) -> str:
+        return repr(block_id)
+
+    def get(self, block_id) -> Optional[pa.Table]:
+        key = self._key(block_id)
+        with self._lock:
+            row = self._db.execute("select file from blocks where key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "update blocks set last_access = ? where key = ?", (time.time(), key)
+            )
+
+        try:
+            # zero copy, the table points into the mapped file
+            return map_arrow_file(row[0])
+        except (FileNotFoundError, pa.ArrowInvalid):
+            # evicted by another process in the meantime
+            with self._lock:
+                self._db.execute("delete from blocks where key = ? and file = ?", (key, row[0]))
+            return None
+
+    def put(self, block_id, block_data: pa.Table, prefetched: bool = False, confidence: Optional[float] = None):
+        # prefetched blocks are not kept apart in the shared cache
+        key = self._key(block_id)
+        path = os.path.join(self.directory, key_file_name(block_id))
+        # written aside and renamed, readers never see a partial file
+        nbytes = write_arrow_file(path, block_data)
+
+        with self._lock:
+            self._db.execute("begin immediate")
+            try:
+                self._db.execute(
+                    "insert or replace into blocks (key, file, nbytes, last_access) values (?, ?, ?, ?)",
+                    (key, path, nbytes, time.time()),
+                )
+                evicted = self._evict()
+                self._db.execute("commit")
+            except Exception:
+                self._db.execute("rollback")
+                raise
+
+        for file in evicted:
+            self._unlink(file)
+
+    def _evict(self):
+        # inside the put transaction, returns the files to delete
+        total = self._db.execute("select coalesce(sum(nbytes), 0) from blocks").fetchone()[0]
+        evicted = []
+        if total <= self.capacity_bytes:
+            return evicted
+
+        rows = self._db.execute(
+            "select key, file, nbytes from blocks order by last_access"
+        ).fetchall()
+        # never evict the block just written
+        for key, file, nbytes in rows[:-1]:
+            if total <= self.capacity_bytes:
+                break
+            self._db.execute("delete from blocks where key = ?", (key,))
+            evicted.append(file)
+            total -= nbytes
+        return evicted
+
+    def _unlink(self, file: str):
+        # processes that still map the file keep their pages until unmapped
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+    def contains(self, block_id) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "select 1 from blocks where key = ?", (self._key(block_id),)
+            ).fetchone()
+        return row is not None
+
+    def remove(self, block_id):
+        key = self._key(block_id)
+        with self._lock:
+            row = self._db.execute("select file from blocks where key = ?", (key,)).fetchone()
+            self._db.execute("delete from blocks where key = ?", (key,))
+        if row is not None:
+            self._unlink(row[0])
+
+    def clear(self):
+        with self._lock:
+            files = [r[0] for r in self._db.execute("select file from blocks").fetchall()]
+            self._db.execute("delete from blocks")
+        for file in files:
+            self._unlink(file)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("select count(*) from blocks").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            count, nbytes = self._db.execute(
+                "select count(*), coalesce(sum(nbytes), 0) from blocks"
+            ).fetchone()
+        return {
+            "capacity_bytes": self.capacity_bytes,
+            "size": count,
+            "bytes": nbytes,
+            "directory": self.directory,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,145 @@
+# spill_tier.py
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+import pyarrow as pa
+
+
+def write_arrow_file(path: str, table: pa.Table) -> int:
+    """
+    Write table as an uncompressed Arrow IPC file, atomically. Returns the
+    file size in bytes.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    nbytes = os.path.getsize(tmp_path)
+    os.replace(tmp_path, path)
+    return nbytes
+
+
+def map_arrow_file(path: str) -> pa.Table:
+    """
+    Zero copy read of an Arrow IPC file, the table points into the mapping.
+    """
+    with pa.memory_map(path, "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def key_file_name(key: Any) -> str:
+    return hashlib.sha1(repr(key).encode()).hexdigest() + ".arrow"
+
+
+class SpillTier:
+    """
+    Second BlockCache tier on local disk.
+
+    Blocks evicted from memory are written once as uncompressed Arrow IPC
+    files and mapped back with pa.memory_map on the next access, which
+    costs a page cache lookup instead of a Parquet decode. The tier has
+    its own byte budget and evicts least recently used files beyond it.
+    """
+
+    def __init__(self, directory: Optional[str] = None, capacity_bytes: int = 4 << 30):
+        self._own_directory = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix="blockcache_spill_")
+        os.makedirs(self.directory, exist_ok=True)
+        self.capacity_bytes = capacity_bytes
+
+        # block_id -> (path, nbytes), LRU first
+        self.files = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def put(self, block_id, table: pa.Table):
+        with self._lock:
+            if block_id in self.files:
+                # same block spilled before, the file is still valid
+                self.files.move_to_end(block_id)
+                return
+
+        path = os.path.join(self.directory, key_file_name(block_id))
+        try:
+            nbytes = write_arrow_file(path, table)
+        except OSError as e:
+            print(f"[SpillTier] could not spill block {block_id}: {e}")
+            return
+
+        evicted = []
+        with self._lock:
+            self.files[block_id] = (path, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.capacity_bytes and len(self.files) > 1:
+                _, (old_path, old_bytes) = self.files.popitem(last=False)
+                self.bytes -= old_bytes
+                evicted.append(old_path)
+
+        for old_path in evicted:
+            self._unlink(old_path)
+
+    def get(self, block_id) -> Optional[pa.Table]:
+        with self._lock:
+            entry = self.files.get(block_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.files.move_to_end(block_id)
+            self.hits += 1
+
+        try:
+            return map_arrow_file(entry[0])
+        except (OSError, pa.ArrowInvalid):
+            self.remove(block_id)
+            return None
+
+    def contains(self, block_id) -> bool:
+        return block_id in self.files
+
+    def remove(self, block_id):
+        with self._lock:
+            entry = self.files.pop(block_id, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+        if entry is not None:
+            self._unlink(entry[0])
+
+    def clear(self):
+        with self._lock:
+            paths = [path for path, _ in self.files.values()]
+            self.files.clear()
+            self.bytes = 0
+        for path in paths:
+            self._unlink(path)
+
+    def _unlink(self, path: str):
+        # tables still mapping the file keep their pages until released
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self.files)
+
+    def stats(self):
+        return {
+            "capacity_bytes": self.capacity_bytes,
+            "bytes": self.bytes,
+            "size": len(self.files),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        self.clear()
+        if self._own_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,33 @@
+from prefetch_scheduler import PrefetchScheduler
+
+
+def test_stride_stops_at_end_of_table():
+    scheduler = PrefetchScheduler(predictor="stride", prefetch_threshold=0.0, num_blocks=40)
+    for block_id in range(30, 40, 2):
+        scheduler.register_access("q", block_id)
+    assert scheduler.suggest_topk_prefetch("q", k=5) is None
+
+    scheduler.forget("q")
+    for block_id in range(26, 36, 2):
+        scheduler.register_access("q", block_id)
+    suggestions = scheduler.suggest_topk_prefetch("q", k=5)
+    assert [block_id for block_id, _ in suggestions] == [36, 38]
+
+
+def test_tournament_drops_blocks_past_end_of_table():
+    scheduler = PrefetchScheduler(predictor=["stride", "delta"], prefetch_threshold=0.0, num_blocks=40)
+    for block_id in range(20, 40, 2):
+        scheduler.register_access("q", block_id)
+    assert scheduler.suggest_topk_prefetch("q", k=5) is None
+
+
+def test_least_recently_active_queries_are_forgotten():
+    scheduler = PrefetchScheduler(predictor=["stride", "markov2"], max_sessions=8)
+    for i in range(100):
+        for block_id in (1, 2, 3, 4):
+            scheduler.register_access(f"request-{i}", block_id)
+        scheduler.suggest_topk_prefetch(f"request-{i}")
+
+    assert list(scheduler.query_history) == [f"request-{i}" for i in range(92, 100)]
+    assert set(scheduler._issued) <= set(scheduler.query_history)
+    assert set(scheduler.predictors["markov2"].recent) == set(scheduler.query_history)
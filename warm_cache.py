@@ -0,0 +1,242 @@
+# warm_cache.py
+
+import json
+import os
+import threading
+import time
+from typing import List, Optional
+
+from block_cache import BlockCache
+from spill_tier import key_file_name, map_arrow_file, write_arrow_file
+
+
+class WarmCache:
+    """
+    Keeps the hot blocks of an engine's BlockCache across restarts.
+
+    snapshot() writes a manifest of the cached blocks, most recently used
+    first, with their MicroBlockIndex usage counters. With save_blocks the
+    decoded blocks are written next to it as Arrow IPC files, so a restart
+    maps them back instead of decoding Parquet.
+
+    rehydrate() restores the usage counters and refills the cache on a
+    background thread while queries already run. Blocks load in order of
+    priority, "recency" (snapshot order) or "ewma" (ewma_usage), and
+    loading stops once the demand region of the cache (capacity minus
+    prefetch_capacity) is full, so blocks queries pulled in meanwhile are
+    not evicted. Prefetched blocks no query used are not snapshotted.
+    Blocks of a Parquet file that changed since the snapshot are skipped.
+
+    Only a BlockCache is supported. A SharedBlockCache keeps its blocks on
+    disk across restarts already.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(
+        self,
+        engine,
+        directory: str = "warm_cache",
+        save_blocks: bool = True,
+        priority: str = "recency",
+        max_blocks: Optional[int] = None,
+    ):
+        if priority not in ("recency", "ewma"):
+            raise ValueError(f"unknown priority {priority}, use recency or ewma")
+        if engine.block_cache is not None and not isinstance(engine.block_cache, BlockCache):
+            raise ValueError(f"WarmCache needs a BlockCache, not {type(engine.block_cache).__name__}")
+
+        self.engine = engine
+        self.directory = directory
+        self.save_blocks = save_blocks
+        self.priority = priority
+        self.max_blocks = max_blocks
+
+        self._thread = None
+        self._stop = threading.Event()
+        self.rehydrated = 0
+
+    # ------------------------------------------------------------
+    # snapshot on shutdown
+    # ------------------------------------------------------------
+    def _fingerprint(self, table_name: str) -> dict:
+        path = self.engine.tables[table_name]["parquet_path"]
+        st = os.stat(path)
+        return {"parquet_path": path, "size": st.st_size, "mtime": st.st_mtime}
+
+    def _block_of(self, key):
+        # cache key of the engine -> (table, row group), None for other keys
+        if isinstance(key, int):
+            return self.engine.table_name, key
+        if isinstance(key, tuple) and len(key) == 2 and key[0] in self.engine.tables:
+            return key
+        return None
+
+    def _read_manifest(self) -> Optional[dict]:
+        path = os.path.join(self.directory, self.MANIFEST)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[WarmCache] could not read {path}: {e}")
+            return None
+
+    def snapshot(self) -> int:
+        """
+        Save the blocks currently in the engine's block cache.
+        Returns the number of blocks in the snapshot.
+        """
+        cache = self.engine.block_cache
+        if cache is None:
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+
+        previous = self._read_manifest() or {}
+        tables = {name: self._fingerprint(name) for name in self.engine.tables}
+        unchanged = {
+            name for name, fp in tables.items()
+            if previous.get("tables", {}).get(name) == fp
+        }
+
+        # most recently used first, without predictions no query used
+        stats = cache.stats()
+        unused = set(stats.get("prefetched_blocks", []))
+        keys = [k for k in reversed(stats.get("cached_blocks", [])) if k not in unused]
+        if self.max_blocks is not None:
+            keys = keys[: self.max_blocks]
+
+        entries = []
+        for key in keys:
+            block = self._block_of(key)
+            if block is None:
+                continue
+            table_name, rg = block
+            usage = self.engine.mb_index.usage_for_row_group(table_name, rg) or (0, 0, 0.0)
+            entry = {
+                "table": table_name,
+                "row_group": rg,
+                "access_count": usage[0],
+                "last_access_ts": usage[1],
+                "ewma_usage": usage[2],
+            }
+
+            if self.save_blocks:
+                file_name = key_file_name((table_name, rg))
+                path = os.path.join(self.directory, file_name)
+                # same file and row group as last time, the saved block is still valid
+                if not (table_name in unchanged and os.path.exists(path)):
+                    table = cache.cache.get(key)
+                    if table is None:
+                        continue
+                    write_arrow_file(path, table)
+                entry["file"] = file_name
+            entries.append(entry)
+
+        manifest = {"created": time.time(), "tables": tables, "blocks": entries}
+        tmp_path = os.path.join(self.directory, self.MANIFEST + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(self.directory, self.MANIFEST))
+
+        # drop block files no longer in the snapshot
+        keep = {e.get("file") for e in entries}
+        for name in os.listdir(self.directory):
+            if name.endswith(".arrow") and name not in keep:
+                os.remove(os.path.join(self.directory, name))
+
+        print(f"[WarmCache] saved {len(entries)} hot blocks to {self.directory}")
+        return len(entries)
+
+    # ------------------------------------------------------------
+    # rehydrate on startup
+    # ------------------------------------------------------------
+    def _ordered_entries(self, manifest: dict) -> List[dict]:
+        tables = manifest.get("tables", {})
+        entries = []
+        for rank, entry in enumerate(manifest.get("blocks", [])):
+            name = entry["table"]
+            if name not in self.engine.tables:
+                continue
+            if tables.get(name) != self._fingerprint(name):
+                continue
+            entries.append((rank, entry))
+
+        if self.priority == "ewma":
+            entries.sort(key=lambda e: (-e[1]["ewma_usage"], e[0]))
+        return [entry for _, entry in entries]
+
+    def rehydrate(self, background: bool = True):
+        """
+        Refill the block cache from the last snapshot. With background the
+        blocks load on a daemon thread and this returns right away.
+        """
+        cache = self.engine.block_cache
+        manifest = self._read_manifest()
+        if cache is None or manifest is None:
+            return None
+
+        entries = self._ordered_entries(manifest)
+        for entry in entries:
+            self.engine.mb_index.restore_row_group_usage(
+                entry["table"], entry["row_group"],
+                entry["access_count"], entry["last_access_ts"], entry["ewma_usage"],
+            )
+
+        if not background:
+            self._load(entries)
+            return None
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._load, args=(entries,), daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def _load(self, entries: List[dict]):
+        cache = self.engine.block_cache
+        start = time.perf_counter()
+        loaded_keys = []
+
+        # restored blocks are demand blocks, the prefetch region is not theirs
+        demand_capacity = cache.capacity - cache.prefetch_capacity
+        for entry in entries:
+            if self._stop.is_set() or len(cache) - len(cache.prefetched) >= demand_capacity:
+                break
+
+            table_name, rg = entry["table"], entry["row_group"]
+            key = self.engine._cache_key(table_name, rg)
+            if cache.contains(key):
+                continue
+
+            try:
+                table = None
+                file_name = entry.get("file")
+                if file_name and os.path.exists(os.path.join(self.directory, file_name)):
+                    table = map_arrow_file(os.path.join(self.directory, file_name))
+                if table is None:
+                    table = self.engine._parquet_file(table_name).read_row_group(rg)
+            except Exception as e:
+                print(f"[WarmCache] could not load block {rg} of {table_name}: {e}")
+                continue
+
+            cache.put(key, table)
+            loaded_keys.append(key)
+
+        # the top priority block was inserted first, touch them back to
+        # front so it ends up most recently used, without counting hits
+        for key in reversed(loaded_keys):
+            cache.touch(key)
+
+        loaded = len(loaded_keys)
+        self.rehydrated = loaded
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"[WarmCache] rehydrated {loaded} blocks in {elapsed:.1f} ms")
+
+    def wait(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stop(self):
+        self._stop.set()
+        self.wait(timeout=2.0)